@@ -1,10 +1,134 @@
 
 import mailbox
 
-mbox = mailbox.mbox('enron.mbox')
+MBOX_PATH = 'enron.mbox'
+
+# number of worker processes for streaming ingestion (0 = process messages serially in this process)
+import multiprocessing
+NUM_WORKERS = multiprocessing.cpu_count()
+
+# Message index: a sidecar file next to the mbox with the byte offset and length of every
+# message plus its From/To headers. It is built with one sequential pass the first time and
+# reused afterwards (or extended, if messages were appended to the mbox); message bodies are
+# read through a memory map of the mbox, so lookups never reparse the file.
+MBOX_INDEX_PATH = MBOX_PATH + '.idx'
+
+import os
+import time
+import mmap
+import pickle
+from array import array
+from email.parser import BytesHeaderParser
+
+# yields (msg_key, byte offset, raw message bytes) in file order; splits messages exactly
+# like mailbox.mbox does, so the keys are the same as mbox.keys()
+def scan_mbox(path, start_offset=0, first_key=0):
+    msg_key = first_key
+    msg_offset = None
+    lines = None
+    last_was_empty = False
+    pos = start_offset
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        for line in f:
+            if line.startswith(b'From '):
+                if lines is not None:
+                    yield (msg_key, msg_offset, b''.join(lines[:-1] if last_was_empty else lines))
+                    msg_key += 1
+                msg_offset = pos
+                lines = [line]
+                last_was_empty = False
+            elif lines is not None:
+                lines.append(line)
+                last_was_empty = (line == b'\n')
+            pos += len(line)
+    if lines is not None:
+        yield (msg_key, msg_offset, b''.join(lines[:-1] if last_was_empty else lines))
+
+# yields (msg_key, raw message bytes) reading the mbox sequentially
+def stream_mbox(path):
+    for (msg_key, _, raw) in scan_mbox(path):
+        yield (msg_key, raw)
+
+# same as mailbox.mbox.get_message(), but from bytes already in memory
+def parse_mbox_message(raw):
+    (from_line, _, string) = raw.partition(b'\n')
+    msg = mailbox.mboxMessage(string)
+    msg.set_from(from_line[5:].decode('ascii'))
+    return msg
+
+# only the header block is parsed, the body is never looked at
+def parse_tofrom(raw):
+    header_block = raw.partition(b'\n')[2].partition(b'\n\n')[0]
+    headers = BytesHeaderParser().parsebytes(header_block)
+    return (headers['From'], headers['To'])
+
+# drop-in replacement for mailbox.mbox for reading: keys(), get(msg_key), len()
+class IndexedMbox:
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path if index_path is not None else path + '.idx'
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.tofrom = []
+        self.load_index()
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b''
+
+    def load_index(self):
+        st = os.stat(self.path)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        scan_from = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                idx = pickle.load(f)
+            if idx['size'] == st.st_size and idx['mtime_ns'] == st.st_mtime_ns:
+                (self.offsets, self.lengths, self.tofrom) = (idx['offsets'], idx['lengths'], idx['tofrom'])
+                return
+            if idx['size'] < st.st_size and len(idx['offsets']) > 0:
+                # mbox files only grow at the end: keep everything before the last indexed
+                # message (which may have been extended) and scan the rest
+                (self.offsets, self.lengths, self.tofrom) = (idx['offsets'][:-1], idx['lengths'][:-1], idx['tofrom'][:-1])
+                scan_from = idx['offsets'][-1]
+        for (msg_key, offset, raw) in scan_mbox(self.path, scan_from, len(self.offsets)):
+            self.offsets.append(offset)
+            self.lengths.append(len(raw))
+            self.tofrom.append(parse_tofrom(raw))
+        with open(self.index_path + '.tmp', 'wb') as f:
+            pickle.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                         'offsets': self.offsets, 'lengths': self.lengths, 'tofrom': self.tofrom},
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def keys(self):
+        return list(range(len(self.offsets)))
+
+    def get_bytes(self, msg_key):
+        offset = self.offsets[msg_key]
+        return self.map[offset : offset + self.lengths[msg_key]]
+
+    def get(self, msg_key, default=None):
+        if msg_key < 0 or msg_key >= len(self.offsets):
+            return default
+        return parse_mbox_message(self.get_bytes(msg_key))
+
+    # From/To headers straight from the index, usable with check_good_tofrom()
+    def get_headers(self, msg_key):
+        (msgfrom, msgto) = self.tofrom[msg_key]
+        return {'From': msgfrom, 'To': msgto}
+
+start = time.time()
+mbox = IndexedMbox(MBOX_PATH, MBOX_INDEX_PATH)
+print("Indexed %d messages in %.2f seconds" % (len(mbox), time.time() - start))
 
 import re
-def cleanup_email(msgbody):
+# original cleanup, one re.sub after another over the whole body; kept as the reference
+# that cleanup_email must match exactly (see BENCHMARK_CLEANUP below)
+def cleanup_email_reference(msgbody):
     regex_replies = re.compile('(\-+Original Message|\-\-+|~~+).*', re.DOTALL) # find 'Original Message...' and variants
     msgbody = re.sub(regex_replies, '', msgbody)
     msgbody = re.sub(r'=\d\d', ' ', msgbody) # remove funny email formatting issues
@@ -22,6 +146,95 @@ def cleanup_email(msgbody):
     msgbody = re.sub(r'\x01', ' ', msgbody) # fix odd spaces
     return msgbody.strip()
 
+# The same rules with precompiled patterns. The body is cut at the first reply marker before
+# anything else, and the quote/link rules run on a growing window until the first big gap,
+# big indentation or pasted header is found, so text after a cut is never scanned.
+CLEANUP_REPLIES = ('--', '-Original Message', '~~') # find 'Original Message...' and variants
+CLEANUP_GAPS = ('\n\n\n\n\n', '\t', '    ') # large gaps and big indentations (i.e., a quoted document)
+CLEANUP_PASTES = ('From: ', 'Subject: ', 'To: ') # pasted emails
+CLEANUP_QP = re.compile(r'=\d\d') # funny email formatting issues
+CLEANUP_QUOTES = re.compile(r'\s*>.*') # quotes
+CLEANUP_LINKS = re.compile(r'https?://.*?\s') # links
+CLEANUP_NEWLINES = re.compile(r'=\s*\n') # broken newlines
+CLEANUP_APOSTROPHES = re.compile(r' ,[stm]') # funny apostrophe 's and 't and 'm
+CLEANUP_QUESTIONS = re.compile(r'[?.]\?') # funny extra question marks
+CLEANUP_WINDOW = 4096 # characters examined before looking further into the body
+
+# position of the first occurrence of any of the strings, or len(text)
+def find_first(text, strings, end):
+    for s in strings:
+        i = text.find(s, 0, end + len(s) - 1)
+        if i >= 0:
+            end = i
+    return end
+
+def find_cut(text):
+    end = find_first(text, CLEANUP_GAPS, len(text))
+    for s in CLEANUP_PASTES:
+        i = text.find(s, 0, end + len(s) - 1)
+        # a pasted header whose trailing space starts a big indentation is cut at the indentation
+        while i >= 0 and text.startswith('   ', i + len(s)):
+            i = text.find(s, i + 1, end + len(s) - 1)
+        if i >= 0:
+            end = i
+    return end
+
+def cleanup_email(msgbody):
+    msgbody = msgbody[:find_first(msgbody, CLEANUP_REPLIES, len(msgbody))]
+    window = CLEANUP_WINDOW
+    while True:
+        # the quote and link rules only look at the current and previous lines, so
+        # everything before the last non-blank line of a window is final
+        end = msgbody.find('\n', window) + 1
+        if end == 0:
+            end = len(msgbody)
+        text = msgbody[:end]
+        if '=' in text:
+            text = CLEANUP_QP.sub(' ', text)
+        if '>' in text:
+            text = CLEANUP_QUOTES.sub('', text)
+        if end < len(msgbody):
+            text = text[:text.rstrip().rfind('\n') + 1]
+        if 'http' in text:
+            text = CLEANUP_LINKS.sub('', text)
+        cut = find_cut(text)
+        # a cut this close to the end of the window might belong to a longer match that continues past it
+        if end == len(msgbody) or cut + 12 <= len(text):
+            text = text[:cut]
+            break
+        window *= 2
+    if '=' in text:
+        text = CLEANUP_NEWLINES.sub('\x01', text)
+    if ' ,' in text:
+        text = CLEANUP_APOSTROPHES.sub('\'\x01', text)
+    if '?' in text:
+        text = CLEANUP_QUESTIONS.sub('\x01', text)
+    return text.replace('\x01', ' ').strip()
+
+def cleanup_emails(msgbodies):
+    return [cleanup_email(msgbody) for msgbody in msgbodies]
+
+# compare cleanup_email with cleanup_email_reference on every message and measure throughput
+BENCHMARK_CLEANUP = False
+
+if BENCHMARK_CLEANUP:
+    msgbodies = []
+    for msg_key in mbox.keys():
+        payload = mbox.get(msg_key).get_payload()
+        if isinstance(payload, str):
+            msgbodies.append(payload)
+    mb = sum(len(msgbody) for msgbody in msgbodies) / 1e6
+    start = time.time()
+    expected = [cleanup_email_reference(msgbody) for msgbody in msgbodies]
+    ref_time = time.time() - start
+    start = time.time()
+    cleaned = cleanup_emails(msgbodies)
+    new_time = time.time() - start
+    mismatches = sum(1 for (a, b) in zip(expected, cleaned) if a != b)
+    print("cleanup_email_reference: %.1f MB/s" % (mb / ref_time))
+    print("cleanup_email: %.1f MB/s (%.1fx)" % (mb / new_time, ref_time / new_time))
+    print("%d of %d messages differ" % (mismatches, len(msgbodies)))
+
 
 # filter out announcement and mailing list emails, and emails to large numbers of people
 def check_good_tofrom(msg):
@@ -31,6 +244,13 @@ def check_good_tofrom(msg):
             re.match(r'.*@enron\.com', msg['From'], re.IGNORECASE) and
             len(msg['To'].split()) <= 3)
 
+# only process messages that pass check_good_tofrom; decided from the index alone
+FILTER_TOFROM = False
+
+def good_tofrom_keys(mbox):
+    return [msg_key for msg_key in mbox.keys()
+            if mbox.tofrom[msg_key][0] is not None and check_good_tofrom(mbox.get_headers(msg_key))]
+
 
 import spacy
 nlp = spacy.load('en')
@@ -105,38 +325,597 @@ def extract_relationships2(doc, msgfrom, msgto):
                         relationships.append((subj, verb.lemma_, vr.lemma_))
     return relationships
 
+# Parse cache: spaCy parses (as DocBin bytes) and extracted relationships, stored in a SQLite
+# file and keyed by a hash of the cleaned message body and the model name/version. Relationships
+# are also keyed by the From/To names and the compiled code of the relationship rules, so after
+# changing extract_relationships2 or find_referent the cached parses are reused and only the
+# (cheap) rules run again. Messages the pre-filter (below) rejects have no parse to keep, so the
+# rejection itself is cached, keyed by the body, the model and the code of the pre-filter but not
+# the rules, and such a message skips spaCy after a rules change as well. Least recently used
+# entries are evicted above PARSE_CACHE_MAX_BYTES.
+PARSE_CACHE_PATH = 'enron_parses.sqlite' # None disables the cache
+PARSE_CACHE_MAX_BYTES = 4 * 1024**3
+
+import sqlite3
+import hashlib
+import marshal
+from spacy.tokens import DocBin
+
+DOC_ATTRS = ['ORTH', 'TAG', 'POS', 'LEMMA', 'HEAD', 'DEP', 'ENT_IOB', 'ENT_TYPE']
+MODEL_ID = '%s_%s-%s (spacy %s)' % (nlp.meta['lang'], nlp.meta['name'], nlp.meta['version'], spacy.__version__)
+RULES_ID = hashlib.sha1(marshal.dumps(find_referent.__code__) + marshal.dumps(extract_relationships2.__code__)).hexdigest()
+
+class ParseCache:
+    # read-only caches (in worker processes) never write; what they would have stored and
+    # which entries they used are collected in pending/used and handed to the writer
+    def __init__(self, path, max_bytes, readonly=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.pending = []
+        self.used = []
+        self.db = None
+        if not readonly:
+            self.connect()
+            self.db.execute('PRAGMA journal_mode=WAL') # readers in other processes don't block the writer
+            self.db.execute('CREATE TABLE IF NOT EXISTS parses (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS parses_last_used ON parses (last_used)')
+            self.db.commit()
+            self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM parses').fetchone()[0]
+
+    # connections must not cross a fork, so close() before starting worker processes;
+    # the connection is reopened when it is next needed
+    def connect(self):
+        if self.db is None:
+            if self.readonly:
+                self.db = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True, timeout=60)
+            else:
+                self.db = sqlite3.connect(self.path, timeout=60)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def get(self, key):
+        self.connect()
+        row = self.db.execute('SELECT value FROM parses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.used.append(key)
+        return row[0]
+
+    def put(self, key, value):
+        self.pending.append((key, value))
+
+    # write pending entries, mark used entries as recently used and evict the oldest ones
+    def flush(self):
+        self.connect()
+        now = time.time()
+        for (key, value) in self.pending:
+            old = self.db.execute('SELECT size FROM parses WHERE key = ?', (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.db.execute('INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?)', (key, value, len(value), now))
+            self.total_bytes += len(value)
+        self.db.executemany('UPDATE parses SET last_used = ? WHERE key = ?', [(now, key) for key in self.used])
+        if self.total_bytes > self.max_bytes:
+            evict = []
+            for (key, size) in self.db.execute('SELECT key, size FROM parses ORDER BY last_used'):
+                if self.total_bytes <= 0.9 * self.max_bytes:
+                    break
+                evict.append((key,))
+                self.total_bytes -= size
+            self.db.executemany('DELETE FROM parses WHERE key = ?', evict)
+        self.db.commit()
+        self.pending = []
+        self.used = []
+
+def cache_key(*parts):
+    return hashlib.sha1('\0'.join('%s' % part for part in parts).encode('utf-8', 'surrogateescape')).hexdigest()
+
+# relationships for a cleaned body from the cache (re-running the rules on a cached parse if
+# needed), or None if the body has to go through the spaCy pipeline
+def cached_relationships(cache, text, msgfrom, msgto):
+    value = cache.get(cache_key('rels', RULES_ID, MODEL_ID, msgfrom, msgto, text))
+    if value is not None:
+        return pickle.loads(value)
+    value = cache.get(cache_key('doc', MODEL_ID, text))
+    if value is None:
+        return None
+    msgnlp = list(DocBin(attrs=DOC_ATTRS).from_bytes(value).get_docs(nlp.vocab))[0]
+    try:
+        rels = extract_relationships2(msgnlp, msgfrom, msgto)
+    except:
+        rels = []
+    cache.put(cache_key('rels', RULES_ID, MODEL_ID, msgfrom, msgto, text), pickle.dumps(rels))
+    return rels
+
+def cache_relationships(cache, text, msgfrom, msgto, rels):
+    cache.put(cache_key('rels', RULES_ID, MODEL_ID, msgfrom, msgto, text), pickle.dumps(rels))
+
+def cache_parse(cache, text, msgfrom, msgto, msgnlp, rels):
+    docbin = DocBin(attrs=DOC_ATTRS)
+    docbin.add(msgnlp)
+    cache.put(cache_key('doc', MODEL_ID, text), docbin.to_bytes())
+    cache_relationships(cache, text, msgfrom, msgto, rels)
+
+parse_cache = ParseCache(PARSE_CACHE_PATH, PARSE_CACHE_MAX_BYTES) if PARSE_CACHE_PATH is not None else None
+
+# Pre-filter: extract_relationships2 only fires on an nsubj whose head is a VERB and whose
+# text is a PRON or PROPN, and part-of-speech tags come from the tagger alone (the parser and
+# NER don't change them). So a cheap tagger-only pass decides which messages can have any
+# relationships, and the parser and NER only run on those. Update the gate together with the
+# rules if the rules start accepting other kinds of subjects or verbs.
+PREFILTER = True
+
+# how many messages each stage handled or removed
+from collections import Counter
+prefilter_counts = Counter()
+
+def may_have_relationships(doc, counts):
+    has_verb = False
+    has_subject = False
+    for token in doc:
+        if token.pos == VERB:
+            has_verb = True
+        elif token.pos == PRON or token.pos == PROPN:
+            has_subject = True
+    if not has_verb:
+        counts['no_verb'] += 1
+    elif not has_subject:
+        counts['no_subject'] += 1
+    return has_verb and has_subject
+
+GATE_ID = hashlib.sha1(marshal.dumps(may_have_relationships.__code__)).hexdigest()
+
+def cached_rejection(cache, text):
+    return cache.get(cache_key('rejected', GATE_ID, MODEL_ID, text)) is not None
+
+def cache_rejection(cache, text):
+    cache.put(cache_key('rejected', GATE_ID, MODEL_ID, text), b'')
+
+# Runs process (a list of inputs -> a list of docs, e.g. over nlp.pipe) on PIPE_BATCH_SIZE inputs
+# at a time. A batch that raises (say spaCy's E088 on an over-long text) is run again one input at
+# a time, and an input that fails on its own gets None and is counted as failed, so an error only
+# loses its own message, as it did when every message went through nlp() in its own try.
+def pipe_isolated(process, inputs, counts):
+    results = []
+    for start in range(0, len(inputs), PIPE_BATCH_SIZE):
+        batch = inputs[start : start + PIPE_BATCH_SIZE]
+        try:
+            results.extend(process(batch))
+        except Exception:
+            for one in batch:
+                try:
+                    results.extend(process([one]))
+                except Exception:
+                    counts['failed'] += 1
+                    results.append(None)
+    return results
+
+def tag_texts(texts):
+    return list(nlp.pipe(texts, batch_size=PIPE_BATCH_SIZE, disable=['parser', 'ner']))
+
+# the parser and NER over docs that have been through tag_texts
+def parse_tagged(docs):
+    for (name, proc) in nlp.pipeline:
+        if name in ('parser', 'ner'):
+            docs = proc.pipe(docs, batch_size=PIPE_BATCH_SIZE)
+    return list(docs)
+
+def parse_texts(texts):
+    return list(nlp.pipe(texts, batch_size=PIPE_BATCH_SIZE))
+
+# items: list of (msg_key, cleaned body, msgfrom, msgto); returns {msg_key: relationships}
+# for every message that was not lost to an error
+def extract_relationships_from_texts(items, counts):
+    found = {}
+    to_parse = []
+    for (msg_key, text, msgfrom, msgto) in items:
+        rels = cached_relationships(parse_cache, text, msgfrom, msgto) if parse_cache is not None else None
+        if rels is not None:
+            counts['cached'] += 1
+            found[msg_key] = rels
+        elif PREFILTER and len(text) == 0: # cleanup_email strips the body, so nothing is left
+            counts['empty'] += 1
+            found[msg_key] = []
+        elif PREFILTER and parse_cache is not None and cached_rejection(parse_cache, text):
+            counts['cached'] += 1
+            found[msg_key] = []
+            cache_relationships(parse_cache, text, msgfrom, msgto, [])
+        else:
+            to_parse.append((msg_key, text, msgfrom, msgto))
+    texts = [text for (_, text, _, _) in to_parse]
+    if PREFILTER:
+        survivors = []
+        tagged = []
+        for (item, doc) in zip(to_parse, pipe_isolated(tag_texts, texts, counts)):
+            if doc is None:
+                continue
+            if may_have_relationships(doc, counts):
+                survivors.append(item)
+                tagged.append(doc)
+            else:
+                (msg_key, text, msgfrom, msgto) = item
+                found[msg_key] = []
+                if parse_cache is not None:
+                    cache_rejection(parse_cache, text)
+                    cache_relationships(parse_cache, text, msgfrom, msgto, [])
+        parsed = zip(survivors, pipe_isolated(parse_tagged, tagged, counts))
+    else:
+        parsed = zip(to_parse, pipe_isolated(parse_texts, texts, counts))
+    for ((msg_key, text, msgfrom, msgto), msgnlp) in parsed:
+        if msgnlp is None:
+            continue
+        try:
+            found[msg_key] = extract_relationships2(msgnlp, msgfrom, msgto)
+            counts['parsed'] += 1
+            if parse_cache is not None:
+                cache_parse(parse_cache, text, msgfrom, msgto, msgnlp, found[msg_key])
+        except:
+            counts['failed'] += 1
+    return found
+
 def extract_email_relationships(mbox, msg_key):
     message = mbox.get(msg_key)
     if message['From'] is not None and message['To'] is not None:
         try:
-            msgnlp = nlp(cleanup_email(message.get_payload()))
-            return extract_relationships2(msgnlp, message['From'], message['To'].split(', ')[0])
+            item = (msg_key, cleanup_email(message.get_payload()), message['From'], message['To'].split(', ')[0])
         except:
+            prefilter_counts['no_text'] += 1
             return []
+        return extract_relationships_from_texts([item], prefilter_counts).get(msg_key, [])
     else:
+        prefilter_counts['no_from_to'] += 1
         return []
 
-import rdflib
-from rdflib import Graph, Literal, RDF
-from rdflib.namespace import FOAF
+# Triple stores: the relationship graph is kept in one of these backends, both of which take
+# triples in batches (add_many) and answer pattern queries with any of s, p, o bound (triples,
+# which given a limit returns that page of the matches sorted by s, p, o; and count).
+# 'sqlite' needs nothing beyond the standard library; 'sleepycat' is the rdflib graph and needs
+# the python lib bsddb3.
+TRIPLE_STORE = 'sqlite'
+TRIPLE_BATCH_SIZE = 10000 # triples per insert transaction
+
+class SQLiteTripleStore:
+    # terms are interned to integer ids; triples are indexed three ways (SPO, POS, OSP) so a
+    # query with any combination of bound terms is answered from an index
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS triples (s INTEGER, p INTEGER, o INTEGER, PRIMARY KEY (s, p, o)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s);
+            CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p);
+        ''')
+        self.term_ids = {}
+
+    def term_id(self, term, create=False):
+        if term in self.term_ids:
+            return self.term_ids[term]
+        row = self.db.execute('SELECT id FROM terms WHERE term = ?', (term,)).fetchone()
+        if row is not None:
+            self.term_ids[term] = row[0]
+        elif create:
+            self.term_ids[term] = self.db.execute('INSERT INTO terms (term) VALUES (?)', (term,)).lastrowid
+        else:
+            return None
+        return self.term_ids[term]
+
+    def add_many(self, triples):
+        with self.db: # one transaction for the whole batch
+            self.db.executemany('INSERT OR IGNORE INTO triples VALUES (?, ?, ?)',
+                                [(self.term_id(s, True), self.term_id(p, True), self.term_id(o, True))
+                                 for (s, p, o) in triples])
+
+    # WHERE clause and arguments for a pattern, or None if a bound term is not in the store
+    def pattern(self, s, p, o):
+        where = []
+        args = []
+        for (col, term) in (('s', s), ('p', p), ('o', o)):
+            if term is not None:
+                term_id = self.term_id(term)
+                if term_id is None:
+                    return None
+                where.append('t.%s = ?' % col)
+                args.append(term_id)
+        return ((' WHERE ' + ' AND '.join(where) if where else ''), args)
+
+    def triples(self, s=None, p=None, o=None, offset=0, limit=None):
+        pattern = self.pattern(s, p, o)
+        if pattern is None:
+            return []
+        (where, args) = pattern
+        query = '''SELECT ts.term, tp.term, tobj.term FROM triples t
+                   JOIN terms ts ON ts.id = t.s
+                   JOIN terms tp ON tp.id = t.p
+                   JOIN terms tobj ON tobj.id = t.o''' + where
+        if limit is not None:
+            query += ' ORDER BY ts.term, tp.term, tobj.term LIMIT ? OFFSET ?'
+            args = args + [limit, offset]
+        return self.db.execute(query, args).fetchall()
+
+    def count(self, s=None, p=None, o=None):
+        pattern = self.pattern(s, p, o)
+        if pattern is None:
+            return 0
+        (where, args) = pattern
+        return self.db.execute('SELECT COUNT(*) FROM triples t' + where, args).fetchone()[0]
+
+    def clear(self):
+        with self.db:
+            self.db.execute('DELETE FROM triples')
+            self.db.execute('DELETE FROM terms')
+        self.term_ids = {}
+
+    def close(self):
+        self.db.close()
+
+class SleepycatTripleStore:
+    def __init__(self, path):
+        from rdflib import Graph, Literal
+        self.Literal = Literal
+        self.g = Graph('Sleepycat', identifier='enron_relationships') # needs python lib bsddb3
+        self.g.open(path, create = True)
+
+    def add_many(self, triples):
+        self.g.addN((self.Literal(s), self.Literal(p), self.Literal(o), self.g) for (s, p, o) in triples)
+
+    def triples(self, s=None, p=None, o=None, offset=0, limit=None):
+        pattern = tuple(self.Literal(t) if t is not None else None for t in (s, p, o))
+        rows = [(str(s), str(p), str(o)) for (s, p, o) in self.g.triples(pattern)]
+        if limit is None:
+            return rows
+        # the Sleepycat store has no ordered access, so the page is cut from all the matches
+        return sorted(rows)[offset : offset + limit]
+
+    def count(self, s=None, p=None, o=None):
+        pattern = tuple(self.Literal(t) if t is not None else None for t in (s, p, o))
+        return sum(1 for _ in self.g.triples(pattern))
+
+    def clear(self):
+        self.g.remove((None, None, None))
+
+    def close(self):
+        self.g.close()
+
+def open_triple_store():
+    if TRIPLE_STORE == 'sleepycat':
+        return SleepycatTripleStore('enron_relationships.rdf')
+    return SQLiteTripleStore('enron_relationships.sqlite')
+
+# the predicate is lemmatized the same way extract_relationships2 lemmatizes verbs; most
+# queries repeat a small set of predicates, so the parse is done once per predicate
+import functools
+
+@functools.lru_cache(maxsize=10000)
+def lemmatize_predicate(predicate):
+    return nlp(predicate)[0].lemma_
 
 def query_relationships(predicate, g, msg_key_idx, msg_key_idx_reverse):
-    doc = nlp(predicate)
-    p = Literal(doc[0].lemma_)
-    qres = g.query('SELECT ?s ?o WHERE { ?s ?p ?o . }', initBindings = {'p' : p})
-
-    for row in qres:
-        r = (row[0], p, row[1])
-        print("%s\t*%s*\t%s -- msg_keys: %s" % (row[0], p, row[1], msg_key_idx[r]))
-
-def create_graph_from_email_relationships(mbox):
-    g = Graph('Sleepycat', identifier='enron_relationships') # needs python lib bsddb3
-    g.open('enron_relationships.rdf', create = True)
-    msg_key_idx = {}
-    msg_key_idx_reverse = {}
+    p = lemmatize_predicate(predicate)
+    start = time.time()
+    rows = g.triples(p=p)
+    elapsed = time.time() - start
+
+    for (s, _, o) in rows:
+        r = (s, p, o)
+        print("%s\t*%s*\t%s -- msg_keys: %s" % (s, p, o, msg_key_idx[r]))
+    print("%d relationships in %.1f ms" % (len(rows), elapsed * 1000))
+
+# Structured, batched form of query_relationships: for each predicate, the relationships
+# (optionally restricted to a subject and/or object) sorted by subject and object, one page
+# of them at a time (sorted and cut by the triple store), with the keys of the messages each
+# one came from.
+def query_relationships_batch(predicates, g, msg_key_idx, subject=None, obj=None, offset=0, limit=100):
+    if offset < 0 or limit < 0:
+        raise ValueError('offset and limit must not be negative')
+    results = {}
+    for predicate in predicates:
+        p = lemmatize_predicate(predicate)
+        rows = g.triples(s=subject, p=p, o=obj, offset=offset, limit=limit)
+        results[predicate] = {'predicate': p,
+                              'total': g.count(s=subject, p=p, o=obj),
+                              'offset': offset,
+                              'relationships': [{'subject': s, 'object': o, 'msg_keys': msg_key_idx[(s, p, o)]}
+                                                for (s, _, o) in rows]}
+    return results
+
+# add the relationships found in one message to the batch of new triples and the message key indexes
+def add_email_relationships(triples, msg_key_idx, msg_key_idx_reverse, msg_key, rels):
+    # for each relationship
+    for (s, p, o) in rels:
+        
+        r = (str(s), str(p), str(o))
+        
+        # add relationship to the graph (in the next batch)
+        triples.append(r)
+        
+        # remember which message(s) had this relationship
+        if r in msg_key_idx:
+            msg_key_idx[r].append(msg_key)
+        else:
+            msg_key_idx[r] = [msg_key]
+            
+        # remember the relationships this message had
+        if msg_key in msg_key_idx_reverse:
+            msg_key_idx_reverse[msg_key].append(r)
+        else:
+            msg_key_idx_reverse[msg_key] = [r]
+
+# Provenance index: msg_key_idx and msg_key_idx_reverse written to one file at the end of a
+# graph build and memory-mapped for queries, so a new process can look up which messages
+# had a relationship (and vice versa) without rebuilding anything. Triples are interned as
+# ids in sorted order of their encoded bytes; msg keys per triple and triple ids per msg key
+# are stored CSR-style as sorted uint32 arrays with offset arrays into them. The header also
+# records the mbox the index was built from (its size, mtime, number of messages and the length
+# of the last one), so messages appended to the mbox later can be ingested on top of it.
+PROVENANCE_PATH = 'enron_provenance.idx'
+PROVENANCE_MAGIC = b'ENRONPV2'
+PROVENANCE_HEADER = '<8sQQQQQQQQQ'
+
+import struct
+
+def encode_triple(r):
+    return '\0'.join(r).encode('utf-8', 'surrogateescape')
+
+def decode_triple(b):
+    return tuple(b.decode('utf-8', 'surrogateescape').split('\0'))
+
+# mbox: the IndexedMbox whose messages the index covers
+def write_provenance_index(path, msg_key_idx, msg_key_idx_reverse, mbox):
+    encoded = sorted((encode_triple(r), r) for r in msg_key_idx)
+    triple_ids = {}
+    triple_offsets = array('Q', [0])
+    indptr = array('Q', [0])
+    postings = array('I')
+    for (b, r) in encoded:
+        triple_ids[r] = len(triple_ids)
+        triple_offsets.append(triple_offsets[-1] + len(b))
+        postings.extend(sorted(set(msg_key_idx[r])))
+        indptr.append(len(postings))
+    blob = b''.join(b for (b, _) in encoded)
+    blob += b'\0' * (-len(blob) % 8)
+    num_msgs = max(msg_key_idx_reverse) + 1 if len(msg_key_idx_reverse) > 0 else 0
+    rev_indptr = array('Q', [0])
+    rev_postings = array('I')
+    for msg_key in range(num_msgs):
+        if msg_key in msg_key_idx_reverse:
+            rev_postings.extend(sorted(set(triple_ids[r] for r in msg_key_idx_reverse[msg_key])))
+        rev_indptr.append(len(rev_postings))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(struct.pack(PROVENANCE_HEADER, PROVENANCE_MAGIC, len(encoded), len(blob),
+                            len(postings), num_msgs, len(rev_postings), mbox.size, mbox.mtime_ns,
+                            len(mbox), mbox.lengths[-1] if len(mbox) > 0 else 0))
+        for a in (triple_offsets, indptr, rev_indptr):
+            f.write(a.tobytes())
+        f.write(blob)
+        for a in (postings, rev_postings):
+            f.write(a.tobytes())
+            f.write(b'\0' * (-len(a.tobytes()) % 8))
+    os.replace(path + '.tmp', path)
+
+# read-only, mapping-like view of msg_key_idx: index[(s, p, o)] -> sorted list of msg keys
+class ProvenanceIndex:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < struct.calcsize(PROVENANCE_HEADER) or self.map[:8] != PROVENANCE_MAGIC:
+            raise ValueError('%s is not a provenance index' % path)
+        (_, self.num_triples, blob_len, num_postings, self.num_msgs, num_rev_postings,
+         self.mbox_size, self.mbox_mtime_ns, self.mbox_messages, self.mbox_last_length) = \
+            struct.unpack_from(PROVENANCE_HEADER, self.map)
+        self.view = memoryview(self.map)
+        pos = struct.calcsize(PROVENANCE_HEADER)
+        def section(length, itemsize, typecode):
+            nonlocal pos
+            a = self.view[pos : pos + length * itemsize].cast(typecode)
+            pos += length * itemsize + (-(length * itemsize) % 8)
+            return a
+        self.triple_offsets = section(self.num_triples + 1, 8, 'Q')
+        self.indptr = section(self.num_triples + 1, 8, 'Q')
+        self.rev_indptr = section(self.num_msgs + 1, 8, 'Q')
+        self.blob_start = pos
+        pos += blob_len
+        self.postings = section(num_postings, 4, 'I')
+        self.rev_postings = section(num_rev_postings, 4, 'I')
+
+    def triple_bytes(self, triple_id):
+        return self.map[self.blob_start + self.triple_offsets[triple_id] : self.blob_start + self.triple_offsets[triple_id + 1]]
+
+    # binary search over the sorted triples; None if the triple is not in the index
+    def triple_id(self, r):
+        key = encode_triple(r)
+        (lo, hi) = (0, self.num_triples)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.triple_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_triples and self.triple_bytes(lo) == key:
+            return lo
+        return None
+
+    def triple(self, triple_id):
+        return decode_triple(self.triple_bytes(triple_id))
+
+    def __len__(self):
+        return self.num_triples
+
+    def __contains__(self, r):
+        return self.triple_id(r) is not None
+
+    def __getitem__(self, r):
+        triple_id = self.triple_id(r)
+        if triple_id is None:
+            raise KeyError(r)
+        return self.postings[self.indptr[triple_id] : self.indptr[triple_id + 1]].tolist()
+
+    # triples found in a message
+    def relationships(self, msg_key):
+        if msg_key < 0 or msg_key >= self.num_msgs:
+            return []
+        return [self.triple(triple_id) for triple_id in self.rev_postings[self.rev_indptr[msg_key] : self.rev_indptr[msg_key + 1]]]
+
+    # msg_key_idx and msg_key_idx_reverse as dicts again, to extend the index
+    def to_dicts(self):
+        triples = [self.triple(triple_id) for triple_id in range(self.num_triples)]
+        msg_key_idx = {r: self.postings[self.indptr[i] : self.indptr[i + 1]].tolist() for (i, r) in enumerate(triples)}
+        msg_key_idx_reverse = {}
+        for msg_key in range(self.num_msgs):
+            if self.rev_indptr[msg_key] < self.rev_indptr[msg_key + 1]:
+                msg_key_idx_reverse[msg_key] = [triples[triple_id] for triple_id in
+                                                self.rev_postings[self.rev_indptr[msg_key] : self.rev_indptr[msg_key + 1]]]
+        return (msg_key_idx, msg_key_idx_reverse)
+
+    # how the mbox changed since the index was built: 'same', 'grown' (messages were only
+    # appended after the ones indexed) or 'changed'
+    def mbox_state(self, mbox):
+        if self.mbox_size == mbox.size and self.mbox_mtime_ns == mbox.mtime_ns:
+            return 'same'
+        if (self.mbox_size < mbox.size and self.mbox_messages <= len(mbox) and
+            (self.mbox_messages == 0 or mbox.lengths[self.mbox_messages - 1] == self.mbox_last_length)):
+            return 'grown'
+        return 'changed'
+
+    def close(self):
+        # the map can only be closed once no views of it are left
+        for section in (self.triple_offsets, self.indptr, self.rev_indptr, self.postings, self.rev_postings, self.view):
+            section.release()
+        self.map.close()
+        self.file.close()
+
+# read-only view of msg_key_idx_reverse: reverse[msg_key] -> list of (s, p, o)
+class ReverseProvenanceIndex:
+    def __init__(self, index):
+        self.index = index
+
+    def __contains__(self, msg_key):
+        return len(self.index.relationships(msg_key)) > 0
+
+    def __getitem__(self, msg_key):
+        rels = self.index.relationships(msg_key)
+        if len(rels) == 0:
+            raise KeyError(msg_key)
+        return rels
+
+# index: (msg_key_idx, msg_key_idx_reverse) of messages already in the triple store, to add msgs
+# to rather than starting a new graph
+def create_graph_from_email_relationships(mbox, msgs=None, index=None):
+    g = open_triple_store()
+    if index is None:
+        g.clear()
+        index = ({}, {})
+    (msg_key_idx, msg_key_idx_reverse) = index
+    triples = []
     
     i = 0
-    msgs = mbox.keys()
+    if msgs is None:
+        msgs = mbox.keys()
     msg_count = len(msgs)
     for msg_key in msgs: # no limit now, do all messages
         i += 1
@@ -145,32 +924,221 @@ def create_graph_from_email_relationships(mbox):
     
         # find relationships
         rels = extract_email_relationships(mbox, msg_key)
+        add_email_relationships(triples, msg_key_idx, msg_key_idx_reverse, msg_key, rels)
+        if len(triples) >= TRIPLE_BATCH_SIZE:
+            g.add_many(triples)
+            triples = []
         
-        # for each relationship
-        for (s, p, o) in rels:
-            
-            r = (Literal(s), Literal(p), Literal(o))
-            
-            # add relationship to the graph
-            g.add(r)
-            
-            # remember which message(s) had this relationship
-            if r in msg_key_idx:
-                msg_key_idx[r].append(msg_key)
-            else:
-                msg_key_idx[r] = [msg_key]
+        if parse_cache is not None and i % 1000 == 0:
+            parse_cache.flush()
+    
+    g.add_many(triples)
+    if parse_cache is not None:
+        parse_cache.flush()
+    print("Messages per stage:", dict(prefilter_counts))
                 
-            # remember the relationships this message had
-            if msg_key in msg_key_idx_reverse:
-                msg_key_idx_reverse[msg_key].append(r)
+    return (g, msg_key_idx, msg_key_idx_reverse)
+
+# Streaming ingestion: read the mbox file once from start to end (no table of contents,
+# no random access), send chunks of raw messages to a pool of worker processes that each
+# load their own spaCy model and run nlp.pipe over a batch of cleaned bodies, then merge
+# the relationships back into the graph here in the parent.
+
+import threading
+
+CHUNK_SIZE = 200 # messages per task sent to a worker
+PIPE_BATCH_SIZE = 50 # documents per nlp.pipe batch
+MAX_PENDING_CHUNKS_PER_WORKER = 4 # limits how far the reader runs ahead of the workers
+
+def chunk_messages(messages, chunk_size, pending):
+    chunk = []
+    for m in messages:
+        chunk.append(m)
+        if len(chunk) == chunk_size:
+            pending.acquire() # wait here if the workers are falling behind
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        pending.acquire()
+        yield chunk
+
+def init_ingest_worker():
+    global nlp, parse_cache
+    nlp = spacy.load('en')
+    # the parent process is the only writer; new entries are returned with the results
+    if PARSE_CACHE_PATH is not None:
+        parse_cache = ParseCache(PARSE_CACHE_PATH, PARSE_CACHE_MAX_BYTES, readonly=True)
+
+# runs in a worker process; returns the number of messages read, (msg_key, relationships) pairs,
+# the pre-filter counts and the parse cache entries written and used
+# (a message that can't be read or cleaned up is skipped on its own, and the spaCy stages isolate
+# their failures with pipe_isolated, so one bad message never fails the whole chunk)
+def extract_chunk_relationships(chunk):
+    counts = Counter()
+    items = []
+    for (msg_key, raw) in chunk:
+        try:
+            message = parse_mbox_message(raw)
+            if message['From'] is not None and message['To'] is not None:
+                payload = message.get_payload()
+                if isinstance(payload, str): # multipart messages are skipped, as in extract_email_relationships
+                    items.append((msg_key, cleanup_email(payload), message['From'], message['To'].split(', ')[0]))
+                else:
+                    counts['no_text'] += 1
             else:
-                msg_key_idx_reverse[msg_key] = [r]
-                
+                counts['no_from_to'] += 1
+        except Exception:
+            counts['failed'] += 1
+    found = extract_relationships_from_texts(items, counts)
+    results = [(msg_key, found[msg_key]) for (msg_key, _, _, _) in items if msg_key in found]
+    if parse_cache is None:
+        return (len(chunk), results, counts, [], [])
+    (cache_pending, cache_used) = (parse_cache.pending, parse_cache.used)
+    (parse_cache.pending, parse_cache.used) = ([], [])
+    return (len(chunk), results, counts, cache_pending, cache_used)
+
+# messages: iterable of (msg_key, raw message bytes), e.g. stream_mbox(path); index as for
+# create_graph_from_email_relationships
+def create_graph_from_email_relationships_parallel(messages, num_workers, index=None):
+    g = open_triple_store()
+    if index is None:
+        g.clear()
+        index = ({}, {})
+    (msg_key_idx, msg_key_idx_reverse) = index
+    triples = []
+    
+    pending = threading.Semaphore(num_workers * MAX_PENDING_CHUNKS_PER_WORKER)
+    chunks = chunk_messages(messages, CHUNK_SIZE, pending)
+    if parse_cache is not None:
+        parse_cache.close()
+    pool = multiprocessing.Pool(num_workers, initializer=init_ingest_worker)
+    start = time.time()
+    i = 0
+    next_report = 10000
+    # imap (rather than imap_unordered) so relationships are merged in message order
+    for (num_msgs, results, counts, cache_pending, cache_used) in pool.imap(extract_chunk_relationships, chunks):
+        pending.release()
+        prefilter_counts.update(counts)
+        for (msg_key, rels) in results:
+            add_email_relationships(triples, msg_key_idx, msg_key_idx_reverse, msg_key, rels)
+        if len(triples) >= TRIPLE_BATCH_SIZE:
+            g.add_many(triples)
+            triples = []
+        if parse_cache is not None:
+            parse_cache.pending.extend(cache_pending)
+            parse_cache.used.extend(cache_used)
+            parse_cache.flush()
+        i += num_msgs
+        if i >= next_report:
+            print("Message %d, %.1f messages/sec" % (i, i / (time.time() - start)))
+            next_report += 10000
+    g.add_many(triples)
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+    print("Processed %d messages in %.1f seconds (%.1f messages/sec, %d workers)" %
+          (i, elapsed, i / elapsed, num_workers))
+    print("Messages per stage:", dict(prefilter_counts))
+    
     return (g, msg_key_idx, msg_key_idx_reverse)
 
-(g, msg_key_idx, msg_key_idx_reverse) = create_graph_from_email_relationships(mbox)
+# The graph and provenance index from an earlier run are reused if the mbox hasn't changed
+# since, and extended with the new messages if messages were appended to it; otherwise, or if
+# REBUILD_GRAPH is set, the graph is built again (which is cheap for messages already in the
+# parse cache).
+REBUILD_GRAPH = False
+
+index = None
+first_key = 0
+state = 'changed'
+if not REBUILD_GRAPH and os.path.exists(PROVENANCE_PATH):
+    try:
+        stored = ProvenanceIndex(PROVENANCE_PATH)
+    except ValueError: # an index in an older format
+        stored = None
+    if stored is not None:
+        state = stored.mbox_state(mbox)
+        if state == 'grown':
+            index = stored.to_dicts()
+            first_key = stored.mbox_messages
+            print("Adding messages %d to %d to the graph" % (first_key, len(mbox) - 1))
+        stored.close()
+
+if state == 'same':
+    g = open_triple_store()
+else:
+    msgs = good_tofrom_keys(mbox) if FILTER_TOFROM else mbox.keys()
+    msgs = [msg_key for msg_key in msgs if msg_key >= first_key]
+    if NUM_WORKERS > 0:
+        # message bodies are read from the memory-mapped mbox in file order
+        messages = ((msg_key, mbox.get_bytes(msg_key)) for msg_key in msgs)
+        (g, msg_key_idx, msg_key_idx_reverse) = create_graph_from_email_relationships_parallel(messages, NUM_WORKERS, index)
+    else:
+        (g, msg_key_idx, msg_key_idx_reverse) = create_graph_from_email_relationships(mbox, msgs, index)
+    write_provenance_index(PROVENANCE_PATH, msg_key_idx, msg_key_idx_reverse, mbox)
+
+msg_key_idx = ProvenanceIndex(PROVENANCE_PATH)
+msg_key_idx_reverse = ReverseProvenanceIndex(msg_key_idx)
 
 query_relationships("removed", g, msg_key_idx, msg_key_idx_reverse)
 
+# Query server: keeps the graph, provenance index and spaCy model loaded and answers
+#   GET /query?p=removed&p=send[&subject=...][&object=...][&offset=0][&limit=100]
+# with the JSON from query_relationships_batch. Requests are handled one at a time (the
+# SQLite connection and the model are not shared between threads); queries take milliseconds.
+SERVE_QUERIES = False
+QUERY_PORT = 8000
+
+# latency of warm batched queries, over predicates sampled from the graph
+BENCHMARK_QUERIES = False
+
+import json
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path != '/query' or 'p' not in params:
+            self.send_error(404, 'use /query?p=<predicate>')
+            return
+        try:
+            results = query_relationships_batch(params['p'], g, msg_key_idx,
+                                                subject=params.get('subject', [None])[0],
+                                                obj=params.get('object', [None])[0],
+                                                offset=int(params.get('offset', [0])[0]),
+                                                limit=int(params.get('limit', [100])[0]))
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        body = json.dumps(results).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100.0 * len(sorted_values)))]
+
+if BENCHMARK_QUERIES and len(msg_key_idx) > 0:
+    import random
+    predicates = list(set(msg_key_idx.triple(random.randrange(len(msg_key_idx)))[1] for _ in range(200)))
+    for batch_size in [1, 10, 50]:
+        latencies = []
+        for _ in range(200):
+            batch = random.sample(predicates, min(batch_size, len(predicates)))
+            start = time.time()
+            query_relationships_batch(batch, g, msg_key_idx)
+            latencies.append((time.time() - start) * 1000)
+        latencies.sort()
+        print("batch of %d predicates: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms" %
+              (batch_size, percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99)))
+
+if SERVE_QUERIES:
+    print("Serving queries on http://localhost:%d/query" % QUERY_PORT)
+    HTTPServer(('localhost', QUERY_PORT), QueryHandler).serve_forever()
+
 
 
@@ -1,3 +1,4 @@
+
 import wikipedia
 import spacy
 from spacy.matcher import Matcher
@@ -5,26 +6,19 @@ import math
 import re
 from collections import Counter
 
-nlp = spacy.load('en', disable=['parser', 'ner', 'textcat'])
+def load_nlp():
+    return spacy.load('en', disable=['parser', 'ner', 'textcat'])
+
+nlp = load_nlp()
 
-matched_phrases = []
-def collect_sents(matcher, doc, i, matches):
-    match_id, start, end = matches[i]
-    span = doc[start : end]
-    matched_phrases.append(span.lemma_)
-    
 patterns = [[{'POS': 'NOUN', 'IS_ALPHA': True, 'IS_STOP': False, 'OP': '+'}]]
-matcher = Matcher(nlp.vocab)
-for pattern in patterns:
-    matcher.add('keyword', collect_sents, pattern)
 
-def extract_keywords_wikipedia(pagename, num_keywords):
-    global matched_phrases
-    page = wikipedia.page(pagename)
-    pagenlp = nlp(page.content)
-    matched_phrases = []
-    matches = matcher(pagenlp)
-    keywords = dict(Counter(matched_phrases).most_common(100))
+# number of most frequent candidate terms that get a C-value
+MAX_CANDIDATES = 100
+
+# original C-value computation: each candidate is matched against every other candidate with
+# a regex, O(n^2); kept as the reference for compute_cvalues (see BENCHMARK_CVALUES below)
+def compute_cvalues_regex(keywords):
     keywords_cvalues = {}
     for keyword in sorted(keywords.keys()):
         parent_terms = list(filter(lambda t: t != keyword and re.match('\\b%s\\b' % keyword, t), keywords.keys()))
@@ -32,15 +26,485 @@ def extract_keywords_wikipedia(pagename, num_keywords):
         for pt in parent_terms:
             keywords_cvalues[keyword] -= float(keywords[pt])/float(len(parent_terms))
         keywords_cvalues[keyword] *= 1 + math.log(len(keyword.split()), 2)
+    return keywords_cvalues
+
+# A term's parent terms are the longer candidates that start with it, token by token. Every
+# token prefix of every candidate is looked up in the candidate set, so this is linear in the
+# number of candidates (times their length in tokens). Parents are listed in the order of
+# keywords, as the regex version did, so the C-values come out exactly the same.
+def find_parent_terms(keywords):
+    parent_terms = {term: [] for term in keywords}
+    for term in keywords:
+        tokens = term.split(' ')
+        for n in range(1, len(tokens)):
+            prefix = ' '.join(tokens[:n])
+            if prefix in parent_terms:
+                parent_terms[prefix].append(term)
+    return parent_terms
+
+def compute_cvalues(keywords):
+    parent_terms = find_parent_terms(keywords)
+    keywords_cvalues = {}
+    for keyword in sorted(keywords.keys()):
+        keywords_cvalues[keyword] = keywords[keyword]
+        for pt in parent_terms[keyword]:
+            keywords_cvalues[keyword] -= float(keywords[pt])/float(len(parent_terms[keyword]))
+        keywords_cvalues[keyword] *= 1 + math.log(len(keyword.split()), 2)
+    return keywords_cvalues
+
+# candidate terms (lemmatized noun phrases) of a document and how often each occurs
+def match_terms(doc):
+    return extractor.match_terms(doc)
+
+def extract_keywords_doc(doc, num_keywords):
+    return keywords_from_terms(match_terms(doc), num_keywords)
+
+def keywords_from_terms(term_counts, num_keywords):
+    keywords = dict(term_counts.most_common(MAX_CANDIDATES))
+    keywords_cvalues = compute_cvalues(keywords)
     best_keywords = []
     for keyword in sorted(keywords_cvalues, key=keywords_cvalues.get, reverse=True)[:num_keywords]:
         best_keywords.append([keyword, keywords_cvalues[keyword]])
     return best_keywords
 
+# compare compute_cvalues with compute_cvalues_regex on synthetic candidate sets
+BENCHMARK_CVALUES = False
+
+if BENCHMARK_CVALUES:
+    import random
+    import time
+    words = ['%s%s' % (a, b) for a in 'abcdefghijklmnopqrstuvwxyz' for b in 'aeiouy']
+    for n in [100, 1000, 10000, 100000]:
+        keywords = {}
+        while len(keywords) < n:
+            term = ' '.join(random.choice(words) for _ in range(random.choice([1, 1, 2, 2, 3, 4])))
+            keywords[term] = random.randint(1, 1000)
+        start = time.time()
+        cvalues = compute_cvalues(keywords)
+        print("%d candidates: prefix index %.3f s" % (n, time.time() - start), end='')
+        if n <= 10000: # the regex version takes hours beyond this
+            start = time.time()
+            expected = compute_cvalues_regex(keywords)
+            print(", regex %.3f s, identical: %s" % (time.time() - start, cvalues == expected), end='')
+        print()
+
+
+# Keyword extraction that can be shared by many threads or an asyncio server. spaCy pipelines
+# aren't documented as thread-safe, so the one loaded model is only ever used by one parse
+# thread: requests put their texts on a queue, and the parse thread takes whatever is waiting
+# (up to parse_batch_size texts), runs it through nlp.pipe and matches the terms of each doc,
+# handing the term counts back through a future. A batch that raises is parsed again one text
+# at a time, so a bad text fails only its own request. Everything else (fetching pages and
+# ranking the terms) runs in the calling thread, or for the async methods in a thread pool of
+# max_concurrency threads, concurrently with the parses.
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+PARSE_BATCH_SIZE = 16 # texts per nlp.pipe call of the parse thread
+
+class KeywordExtractor:
+    def __init__(self, nlp, max_concurrency=8, parse_batch_size=PARSE_BATCH_SIZE):
+        self.nlp = nlp
+        self.matcher = Matcher(nlp.vocab)
+        for pattern in patterns:
+            self.matcher.add('keyword', None, pattern)
+        self.parse_batch_size = parse_batch_size
+        self.pending = queue.Queue() # (text, future), or None to stop the parse thread
+        self.parser = None
+        self.lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.executor = None
+
+    # doc must come from this extractor's nlp; the dump workers, which have no parse thread,
+    # call this on the docs of their own nlp.pipe
+    def match_terms(self, doc):
+        return Counter(doc[start : end].lemma_ for (match_id, start, end) in self.matcher(doc))
+
+    def parse_texts(self):
+        while True:
+            batch = [self.pending.get()]
+            while batch[-1] is not None and len(batch) < self.parse_batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            batch = [request for request in batch if request is not None]
+            try:
+                docs = self.nlp.pipe([text for (text, _) in batch])
+                for ((_, future), doc) in zip(batch, docs):
+                    future.set_result(self.match_terms(doc))
+            except Exception:
+                for (text, future) in batch:
+                    if not future.done():
+                        try:
+                            future.set_result(self.match_terms(self.nlp(text)))
+                        except Exception as e:
+                            future.set_exception(e)
+            if stop:
+                return
+
+    # a future of the term counts of text
+    def submit(self, text):
+        with self.lock:
+            if self.parser is None:
+                self.parser = threading.Thread(target=self.parse_texts, daemon=True)
+                self.parser.start()
+        future = Future()
+        self.pending.put((text, future))
+        return future
+
+    def text_terms(self, text):
+        return self.submit(text).result()
+
+    def extract_text(self, text, num_keywords):
+        return keywords_from_terms(self.text_terms(text), num_keywords)
+
+    def extract_page(self, pagename, num_keywords):
+        page = wikipedia.page(pagename)
+        return self.extract_text(page.content, num_keywords)
+
+    def run(self, func, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_concurrency)
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def extract_text_async(self, text, num_keywords):
+        term_counts = await asyncio.wrap_future(self.submit(text))
+        return await self.run(keywords_from_terms, term_counts, num_keywords)
+
+    async def extract_page_async(self, pagename, num_keywords):
+        page = await self.run(wikipedia.page, pagename)
+        return await self.extract_text_async(page.content, num_keywords)
+
+    def close(self):
+        with self.lock:
+            if self.parser is not None:
+                self.pending.put(None)
+                self.parser.join()
+                self.parser = None
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+extractor = KeywordExtractor(nlp)
+
+def extract_keywords_wikipedia(pagename, num_keywords):
+    return extractor.extract_page(pagename, num_keywords)
+
+# load test of the async API: each client sends LOAD_TEST_REQUESTS requests one after another,
+# cycling through the texts of LOAD_TEST_PAGES (fetched once up front so the network isn't timed)
+LOAD_TEST = False
+LOAD_TEST_PAGES = ["New York City", "Python (programming language)", "Artificial intelligence", "Computer science"]
+LOAD_TEST_REQUESTS = 20
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+async def load_test_client(extractor, texts, client, latencies):
+    for i in range(LOAD_TEST_REQUESTS):
+        text = texts[(client + i) % len(texts)]
+        start = time.time()
+        await extractor.extract_text_async(text, 10)
+        latencies.append(time.time() - start)
+
+async def load_test(extractor, texts, num_clients):
+    latencies = []
+    await asyncio.gather(*[load_test_client(extractor, texts, client, latencies) for client in range(num_clients)])
+    return latencies
+
+if LOAD_TEST:
+    texts = [wikipedia.page(pagename).content for pagename in LOAD_TEST_PAGES]
+    for num_clients in [1, 4, 16]:
+        start = time.time()
+        latencies = asyncio.run(load_test(extractor, texts, num_clients))
+        elapsed = time.time() - start
+        print("%d clients: %.1f requests/s, p50 %.0f ms, p99 %.0f ms" %
+              (num_clients, len(latencies) / elapsed, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+
+
+# Offline mode: instead of fetching pages one at a time, stream articles from a local dump
+# and write the top keywords of every page to KEYWORDS_OUTPUT_PATH (one JSON object per line).
+# The dump is either a MediaWiki XML export (pages-articles.xml, optionally .bz2) or JSON
+# lines with "title" and "text" fields (optionally .bz2). Pages are sent in chunks to a pool
+# of worker processes, each with its own spaCy model, which run nlp.pipe over the chunk.
+DUMP_PATH = None # e.g. 'enwiki-latest-pages-articles.xml.bz2'
+KEYWORDS_OUTPUT_PATH = 'wikipedia_keywords.jsonl'
+NUM_KEYWORDS = 10
+
+import multiprocessing
+NUM_WORKERS = multiprocessing.cpu_count()
+CHUNK_SIZE = 100 # pages per task sent to a worker
+PIPE_BATCH_SIZE = 20 # pages per nlp.pipe batch
+MAX_PENDING_CHUNKS_PER_WORKER = 4 # limits how far the reader runs ahead of the workers
+
+import bz2
+import json
+import os
+import xml.etree.ElementTree as ET
+
+def open_dump(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+# the XML dumps have wiki markup rather than plain text; drop templates, tables, references,
+# files and tags, and keep the visible text of links
+wiki_templates = re.compile(r'\{\{[^{}]*\}\}|\{\|[^{}]*?\|\}')
+wiki_refs = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>|<!--.*?-->', re.DOTALL)
+wiki_files = re.compile(r'\[\[(?:File|Image|Category):[^\[\]]*(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]', re.IGNORECASE)
+wiki_links = re.compile(r'\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]')
+wiki_external_links = re.compile(r'\[https?://[^\s\]]*\s?([^\]]*)\]')
+wiki_tags = re.compile(r'<[^>]+>')
+wiki_formatting = re.compile(r"'{2,}|^=+\s*|\s*=+$|^[*#:;]+\s*", re.MULTILINE)
+
+def strip_wikitext(text):
+    n = 1
+    while n > 0: # templates nest, so remove the innermost ones until none are left
+        (text, n) = wiki_templates.subn('', text)
+    text = wiki_refs.sub('', text)
+    text = wiki_files.sub('', text)
+    text = wiki_links.sub(r'\1', text)
+    text = wiki_external_links.sub(r'\1', text)
+    text = wiki_tags.sub('', text)
+    return wiki_formatting.sub('', text)
+
+# yields (title, text) for every article (namespace 0, not a redirect) in the dump
+def read_dump_pages(path):
+    with open_dump(path) as f:
+        if '.json' in path: # .jsonl, .jsonl.bz2
+            for line in f:
+                page = json.loads(line)
+                yield (page['title'], page['text'])
+            return
+        root = None
+        title = None
+        ns = '0'
+        redirect = False
+        text = None
+        for (event, elem) in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            tag = elem.tag.rsplit('}', 1)[-1] # ignore the export namespace
+            if tag == 'title':
+                title = elem.text
+            elif tag == 'ns':
+                ns = elem.text
+            elif tag == 'redirect':
+                redirect = True
+            elif tag == 'text':
+                text = elem.text or ''
+            elif tag == 'page':
+                if ns == '0' and not redirect and text is not None:
+                    yield (title, strip_wikitext(text))
+                (title, ns, redirect, text) = (None, '0', False, None)
+                # a cleared page would still be a child of <mediawiki>, so drop it from the root
+                # to keep memory flat while streaming through the dump
+                root.clear()
+
+def chunk_pages(pages, chunk_size, pending):
+    chunk = []
+    for page in pages:
+        chunk.append(page)
+        if len(chunk) == chunk_size:
+            pending.acquire() # wait here if the workers are falling behind
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        pending.acquire()
+        yield chunk
+
+# Corpus term statistics: term and document frequencies plus nested-term counts over every
+# page seen so far, kept in a SQLite file and updated as pages stream in, so C-values and
+# IDF weights for the whole corpus are available without re-processing old pages. Workers
+# collect the term counts of their pages in a TermStatisticsDelta, which is applied to the
+# store at a cost that depends on the delta only; a page already in the store (or twice in a
+# delta) is only counted once. With statistics, every page's output also has its terms ranked
+# by frequency times IDF over the corpus so far (tfidf_keywords). A chunk's statistics and the
+# size of the output file after its keywords are committed together, and a new run first cuts
+# the output back to that size, so after a crash every page is either in both or in neither.
+TERM_STATS_PATH = 'wikipedia_terms.sqlite' # None disables corpus statistics
+IDF_QUERY_TERMS = 500 # terms looked up per query, below SQLite's limit on bound variables
+
+import sqlite3
+
+# token prefixes of a term that are shorter than the term, e.g. 'a b c' -> 'a', 'a b'
+# (the same nesting compute_cvalues uses)
+def term_prefixes(term):
+    tokens = term.split(' ')
+    return [' '.join(tokens[:n]) for n in range(1, len(tokens))]
+
+class TermStatisticsDelta:
+    def __init__(self):
+        self.pages = {} # title -> term counts
+
+    def add_page(self, title, term_counts):
+        if title not in self.pages:
+            self.pages[title] = term_counts
+
+class TermStatistics:
+    # terms: tf = occurrences in the corpus, df = pages containing it, nested_freq/nested_count =
+    # total tf and number of the distinct longer terms that start with it; prefixes that are not
+    # terms themselves (tf = 0) are kept too, since they can become terms later
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, tf INTEGER DEFAULT 0, df INTEGER DEFAULT 0,
+                                              nested_freq INTEGER DEFAULT 0, nested_count INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS pages (title TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        ''')
+
+    def num_docs(self):
+        return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def page_titles(self):
+        return set(title for (title,) in self.db.execute('SELECT title FROM pages'))
+
+    # adds the pages of a delta that aren't in the store yet, and returns their titles; the
+    # changes are only saved by commit()
+    def add(self, delta):
+        new_titles = []
+        term_freq = Counter()
+        doc_freq = Counter()
+        for (title, term_counts) in delta.pages.items():
+            if self.db.execute('INSERT OR IGNORE INTO pages VALUES (?)', (title,)).rowcount > 0:
+                new_titles.append(title)
+                term_freq.update(term_counts)
+                doc_freq.update(term_counts.keys())
+        nested_freq = Counter()
+        nested_count = Counter()
+        for (term, tf) in term_freq.items():
+            row = self.db.execute('SELECT tf FROM terms WHERE term = ?', (term,)).fetchone()
+            is_new = row is None or row[0] == 0
+            for prefix in term_prefixes(term):
+                nested_freq[prefix] += tf
+                if is_new:
+                    nested_count[prefix] += 1
+        rows = [(term, term_freq[term], doc_freq[term], nested_freq[term], nested_count[term])
+                for term in set(term_freq) | set(nested_freq)]
+        self.db.executemany('''INSERT INTO terms VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT (term) DO UPDATE SET tf = tf + excluded.tf, df = df + excluded.df,
+                                   nested_freq = nested_freq + excluded.nested_freq,
+                                   nested_count = nested_count + excluded.nested_count''', rows)
+        return new_titles
+
+    # saves what was added, with the size of the output file that has the added pages' keywords
+    def commit(self, output_size):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('output_size', ?)", (output_size,))
+        self.db.commit()
+
+    def output_size(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'output_size'").fetchone()
+        return row[0] if row is not None else None
+
+    def idf(self, terms):
+        num_docs = self.num_docs()
+        terms = list(terms)
+        df = {}
+        for start in range(0, len(terms), IDF_QUERY_TERMS):
+            batch = terms[start : start + IDF_QUERY_TERMS]
+            df.update(self.db.execute('SELECT term, df FROM terms WHERE term IN (%s)' % ','.join('?' * len(batch)), batch))
+        return {term: math.log(float(num_docs + 1) / float(df.get(term, 0) + 1)) for term in terms}
+
+    # corpus-level C-values, the same formula as compute_cvalues with corpus frequencies
+    def top_cvalues(self, num_keywords, min_freq=2):
+        cvalues = {}
+        for (term, tf, nested_freq, nested_count) in self.db.execute(
+                'SELECT term, tf, nested_freq, nested_count FROM terms WHERE tf >= ?', (min_freq,)):
+            cvalue = float(tf)
+            if nested_count > 0:
+                cvalue -= float(nested_freq) / float(nested_count)
+            cvalues[term] = cvalue * (1 + math.log(len(term.split()), 2))
+        return [[term, cvalues[term]] for term in sorted(cvalues, key=cvalues.get, reverse=True)[:num_keywords]]
+
+    # a page's terms ranked by frequency in the page times IDF over the corpus
+    def rank_page_terms(self, term_counts, num_keywords):
+        idf = self.idf(list(term_counts))
+        scores = {term: count * idf[term] for (term, count) in term_counts.items()}
+        return [[term, scores[term]] for term in sorted(scores, key=scores.get, reverse=True)[:num_keywords]]
+
+def init_keywords_worker():
+    global nlp, extractor
+    nlp = load_nlp()
+    extractor = KeywordExtractor(nlp)
+
+# runs in a worker process; returns the keywords of each page and the term statistics of the chunk
+def extract_keywords_chunk(chunk):
+    titles = [title for (title, _) in chunk]
+    docs = nlp.pipe((text for (_, text) in chunk), batch_size=PIPE_BATCH_SIZE)
+    results = []
+    delta = TermStatisticsDelta()
+    for (title, doc) in zip(titles, docs):
+        term_counts = match_terms(doc)
+        results.append((title, keywords_from_terms(term_counts, NUM_KEYWORDS)))
+        delta.add_page(title, term_counts)
+    return (results, delta)
+
+def keywords_record(title, keywords, term_stats, delta):
+    record = {'title': title, 'keywords': keywords}
+    if term_stats is not None:
+        record['tfidf_keywords'] = term_stats.rank_page_terms(delta.pages[title], NUM_KEYWORDS)
+    return (json.dumps(record) + '\n').encode('utf-8')
+
+def extract_keywords_dump(dump_path, output_path, num_workers, term_stats=None):
+    pages = read_dump_pages(dump_path)
+    if term_stats is not None:
+        # pages already in the corpus statistics were done by an earlier run
+        done = term_stats.page_titles()
+        pages = (page for page in pages if page[0] not in done)
+    mode = 'wb'
+    if term_stats is not None and term_stats.output_size() is not None and os.path.exists(output_path):
+        # drop the keywords of pages whose statistics an interrupted run didn't commit
+        os.truncate(output_path, term_stats.output_size())
+        mode = 'ab'
+    pending = threading.Semaphore(num_workers * MAX_PENDING_CHUNKS_PER_WORKER)
+    chunks = chunk_pages(pages, CHUNK_SIZE, pending)
+    pool = multiprocessing.Pool(num_workers, initializer=init_keywords_worker)
+    start = time.time()
+    i = 0
+    next_report = 10000
+    with open(output_path, mode) as out:
+        for (results, delta) in pool.imap(extract_keywords_chunk, chunks):
+            pending.release()
+            if term_stats is None:
+                for (title, keywords) in results:
+                    out.write(keywords_record(title, keywords, None, delta))
+            else:
+                new_titles = set(term_stats.add(delta))
+                for (title, keywords) in results:
+                    if title in new_titles:
+                        new_titles.discard(title) # a title twice in the chunk is written once
+                        out.write(keywords_record(title, keywords, term_stats, delta))
+                out.flush()
+                os.fsync(out.fileno())
+                term_stats.commit(out.tell())
+            i += len(results)
+            if i >= next_report:
+                print("Page %d, %.0f pages/min" % (i, i / (time.time() - start) * 60))
+                next_report += 10000
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+    print("Extracted keywords from %d pages in %.1f seconds (%.0f pages/min, %d workers)" %
+          (i, elapsed, i / elapsed * 60, num_workers))
+
 
-print(extract_keywords_wikipedia("New York City", 10))
-print(extract_keywords_wikipedia("Python (programming language)", 10))
-print(extract_keywords_wikipedia("Artificial intelligence", 10))
-print(extract_keywords_wikipedia("Computer science", 10))
+if DUMP_PATH is not None:
+    term_stats = TermStatistics(TERM_STATS_PATH) if TERM_STATS_PATH is not None else None
+    extract_keywords_dump(DUMP_PATH, KEYWORDS_OUTPUT_PATH, NUM_WORKERS, term_stats)
+    if term_stats is not None:
+        print("Top corpus terms by C-value:", term_stats.top_cvalues(NUM_KEYWORDS))
+else:
+    print(extract_keywords_wikipedia("New York City", 10))
+    print(extract_keywords_wikipedia("Python (programming language)", 10))
+    print(extract_keywords_wikipedia("Artificial intelligence", 10))
+    print(extract_keywords_wikipedia("Computer science", 10))
 
 
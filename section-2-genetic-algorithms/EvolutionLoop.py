@@ -0,0 +1,318 @@
+
+# The (mu + lambda) loop of deap.algorithms.eaMuPlusLambda with per-generation telemetry, used
+# by GeneticMixTapeGenerator.py and XKCDgenalg.py. It makes the same calls in the same order as
+# DEAP's, so a seeded run evolves exactly the same populations with or without a log; the log
+# just times each phase of a generation:
+#
+#   variation    varOr: cloning, crossover and mutation of the offspring
+#   evaluation   toolbox.map(toolbox.evaluate, ...) over the offspring with invalid fitnesses
+#   halloffame   halloffame.update(offspring)
+#   selection    toolbox.select(population + offspring, mu)
+#   stats        stats.compile and the logbook record
+#
+# A GenerationLog writes one row per generation to a JSON lines (.jsonl) or CSV (.csv) file:
+# those times in seconds, the evaluation count, how many of the evaluations were scored rather
+# than served from a fitness cache, the share of them that got the penalty fitness, and the
+# logbook record flattened to columns (time_avg, genre_avg, ...), i.e. the objective statistics.
+# Every profile_interval generations one whole generation runs under cProfile, saved next to the
+# log as <log>.gen<N>.prof (read it with python -m pstats).
+#
+# A Checkpointer saves the run every interval generations (and after the last one): the
+# generation number, population, hall of fame, logbook and the random and NumPy RNG states,
+# pickled and gzipped into one file. The state is pickled between generations, which is a
+# consistent snapshot, and compressed and written by a background thread, replacing the previous
+# checkpoint only once the new one is complete; a write that fails (on a full disk, say) leaves the
+# previous checkpoint in place and its exception is raised by the next save or by close. Passing
+# loadCheckpoint's state as resume continues the run from its generation exactly as if it had
+# never stopped (the fitness cache starts empty, but it returns the same fitnesses as scoring
+# again).
+#
+# A FitnessCache keeps the fitnesses of the maxsize most recently used individuals, by their
+# tuple of genes, for the evaluators of both scripts to look a batch up in before scoring it.
+
+import cProfile
+import gzip
+import os
+import pickle
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+
+from deap import algorithms
+from deap import tools
+
+PHASES = ['variation', 'evaluation', 'halloffame', 'selection', 'stats']
+
+# (column name, key path) of every value in a (Multi)Statistics record
+def recordColumns(record, prefix=()):
+    for (key, value) in record.items():
+        if isinstance(value, dict):
+            yield from recordColumns(value, prefix + (key,))
+        else:
+            yield ('_'.join(prefix + (key,)), prefix + (key,))
+
+def recordValue(record, path):
+    for key in path:
+        record = record[key]
+    return record
+
+# JSON has no inf or nan, so write them the way json.dumps does (and json.loads reads them)
+def jsonNumber(value):
+    value = float(value)
+    if value - value == 0.0:
+        return repr(value)
+    return 'NaN' if value != value else ('Infinity' if value > 0 else '-Infinity')
+
+class FitnessCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.fitnesses = OrderedDict()
+
+    def get(self, key):
+        fitness = self.fitnesses.get(key)
+        if fitness is not None:
+            self.fitnesses.move_to_end(key)
+        return fitness
+
+    def put(self, key, fitness):
+        self.fitnesses[key] = fitness
+        if len(self.fitnesses) > self.maxsize:
+            self.fitnesses.popitem(last=False)
+
+    # the fitnesses of a batch and how many individuals score(list of individuals) was given: each
+    # one that isn't cached is scored once, even if it's in the batch several times
+    def evaluate(self, individuals, score):
+        keys = [tuple(individual) for individual in individuals]
+        fitnesses = [self.get(key) for key in keys]
+        misses = {}
+        for (i, key) in enumerate(keys):
+            if fitnesses[i] is None and key not in misses:
+                misses[key] = individuals[i]
+        for (key, fitness) in zip(misses, score(list(misses.values()))):
+            self.put(key, fitness)
+            misses[key] = fitness
+        return ([misses[key] if fitness is None else fitness for (key, fitness) in zip(keys, fitnesses)], len(misses))
+
+# A row is written with one %-format of a template made on the first generation, rather than
+# json.dumps or csv.DictWriter of a dict, which cost several times more than a whole XKCD
+# generation's worth of the 2% overhead budget
+class GenerationLog:
+    # scored: function returning how many individuals the last toolbox.map call actually scored
+    # (None when there's no fitness cache); penalty: the fitness values of infeasible individuals
+    # append: continue the log of a resumed run (without writing the CSV header again)
+    def __init__(self, path, scored=None, penalty=None, profile_interval=0, append=False):
+        self.path = path
+        self.csv = path.endswith('.csv')
+        self.scored = scored
+        self.penalty = tuple(penalty) if penalty is not None else None
+        self.penalty_wvalues = None
+        self.profile_interval = profile_interval
+        self.append = append and os.path.exists(path)
+        self.file = open(path, 'a' if self.append else 'w')
+        self.template = None
+        self.record_paths = None
+        self.profiler = None
+        self.totals = [0.0] * len(PHASES)
+
+    def startGeneration(self, gen):
+        if self.profile_interval and gen > 0 and gen % self.profile_interval == 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def makeTemplate(self, record):
+        columns = [('gen', '%d'), ('nevals', '%d')] + [(phase, '%.6g') for phase in PHASES + ['total']]
+        if self.scored is not None:
+            columns += [('scored', '%d'), ('cache_rate', '%.4g')]
+        if self.penalty is not None:
+            columns += [('penalty_rate', '%.4g')]
+        self.record_paths = []
+        for (name, path) in recordColumns(record):
+            columns.append((name, '%s'))
+            self.record_paths.append(path)
+        if self.csv:
+            if not self.append:
+                self.file.write(','.join(name for (name, _) in columns) + '\n')
+            self.template = ','.join(spec for (_, spec) in columns) + '\n'
+        else:
+            self.template = '{' + ', '.join('"%s": %s' % (name, spec) for (name, spec) in columns) + '}\n'
+
+    def endGeneration(self, gen, times, evaluated, record):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats('%s.gen%d.prof' % (self.path, gen))
+            self.profiler = None
+        if self.template is None:
+            self.makeTemplate(record)
+        total = 0.0
+        for (i, seconds) in enumerate(times):
+            self.totals[i] += seconds
+            total += seconds
+        row = [gen, len(evaluated)]
+        row += times
+        row.append(total)
+        if self.scored is not None:
+            scored = self.scored()
+            row += [scored, (len(evaluated) - scored) / len(evaluated) if evaluated else 0.0]
+        if self.penalty is not None:
+            if self.penalty_wvalues is None and evaluated:
+                weights = evaluated[0].fitness.weights
+                self.penalty_wvalues = tuple(value * weight for (value, weight) in zip(self.penalty, weights))
+            penalized = sum(1 for ind in evaluated if ind.fitness.wvalues == self.penalty_wvalues)
+            row.append(penalized / len(evaluated) if evaluated else 0.0)
+        format_value = str if self.csv else jsonNumber
+        for path in self.record_paths:
+            row.append(format_value(recordValue(record, path)))
+        self.file.write(self.template % tuple(row))
+
+    # seconds spent in each phase over the whole run
+    def summary(self):
+        total = sum(self.totals)
+        return ', '.join('%s %.1fs (%.0f%%)' % (phase, seconds, 100.0 * seconds / total if total else 0.0)
+                         for (phase, seconds) in zip(PHASES, self.totals))
+
+    def close(self):
+        self.file.close()
+
+class Checkpointer:
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        # only the newest checkpoint waiting to be written is kept, so a slow disk drops
+        # checkpoints rather than stalling the generations
+        self.pending = queue.Queue(maxsize=1)
+        self.error = None # the first exception of the writer thread, raised by save or close
+        self.writer = threading.Thread(target=self.write, daemon=True)
+        self.writer.start()
+
+    def due(self, gen, ngen):
+        return gen == ngen or (self.interval > 0 and gen % self.interval == 0)
+
+    def save(self, gen, population, halloffame, logbook):
+        if self.error is not None:
+            raise self.error
+        data = pickle.dumps({'gen': gen, 'population': population, 'halloffame': halloffame,
+                             'logbook': logbook, 'random': random.getstate(),
+                             'numpy': numpy.random.get_state()}, pickle.HIGHEST_PROTOCOL)
+        while True:
+            try:
+                self.pending.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self.pending.get_nowait()
+                except queue.Empty:
+                    pass
+
+    # keeps taking checkpoints off the queue after a failure, so that save and close never wait
+    # on a full queue, but writes none once one has failed (the previous checkpoint is intact)
+    def write(self):
+        while True:
+            data = self.pending.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue
+            temporary = self.path + '.tmp'
+            try:
+                with open(temporary, 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=1))
+                os.replace(temporary, self.path)
+            except Exception as e:
+                self.error = e
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+
+    # waits for the last checkpoint to be written
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+def loadCheckpoint(path):
+    with open(path, 'rb') as f:
+        return pickle.loads(gzip.decompress(f.read()))
+
+# deap.algorithms.eaMuPlusLambda, plus log (a GenerationLog or None), checkpoint (a Checkpointer
+# or None) and resume (loadCheckpoint's state to continue from, whose population and halloffame
+# must be the ones passed in)
+def eaMuPlusLambda(population, toolbox, mu, lambda_, cxpb, mutpb, ngen,
+                   stats=None, halloffame=None, verbose=__debug__, log=None, checkpoint=None, resume=None):
+    if resume is not None:
+        logbook = resume['logbook']
+        random.setstate(resume['random'])
+        numpy.random.set_state(resume['numpy'])
+        return evolve(population, toolbox, mu, lambda_, cxpb, mutpb, resume['gen'] + 1, ngen,
+                      stats, halloffame, verbose, log, checkpoint, logbook)
+    clock = time.perf_counter
+    logbook = tools.Logbook()
+    logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+
+    # Evaluate the individuals with an invalid fitness
+    if log is not None:
+        log.startGeneration(0)
+    t0 = clock()
+    invalid_ind = [ind for ind in population if not ind.fitness.valid]
+    fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+    for ind, fit in zip(invalid_ind, fitnesses):
+        ind.fitness.values = fit
+    t1 = clock()
+    if halloffame is not None:
+        halloffame.update(population)
+    t2 = clock()
+    record = stats.compile(population) if stats is not None else {}
+    logbook.record(gen=0, nevals=len(invalid_ind), **record)
+    t3 = clock()
+    if log is not None:
+        log.endGeneration(0, (0.0, t1 - t0, t2 - t1, 0.0, t3 - t2), invalid_ind, record)
+    if verbose:
+        print(logbook.stream)
+    if checkpoint is not None and checkpoint.due(0, ngen):
+        checkpoint.save(0, population, halloffame, logbook)
+
+    return evolve(population, toolbox, mu, lambda_, cxpb, mutpb, 1, ngen,
+                  stats, halloffame, verbose, log, checkpoint, logbook)
+
+# generations first to ngen of eaMuPlusLambda
+def evolve(population, toolbox, mu, lambda_, cxpb, mutpb, first, ngen,
+           stats, halloffame, verbose, log, checkpoint, logbook):
+    clock = time.perf_counter
+    # Begin the generational process
+    for gen in range(first, ngen + 1):
+        if log is not None:
+            log.startGeneration(gen)
+        t0 = clock()
+        # Vary the population
+        offspring = algorithms.varOr(population, toolbox, lambda_, cxpb, mutpb)
+        t1 = clock()
+        # Evaluate the individuals with an invalid fitness
+        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+        t2 = clock()
+        # Update the hall of fame with the generated individuals
+        if halloffame is not None:
+            halloffame.update(offspring)
+        t3 = clock()
+        # Select the next generation population
+        population[:] = toolbox.select(population + offspring, mu)
+        t4 = clock()
+        # Update the statistics with the new population
+        record = stats.compile(population) if stats is not None else {}
+        logbook.record(gen=gen, nevals=len(invalid_ind), **record)
+        t5 = clock()
+        if log is not None:
+            log.endGeneration(gen, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4), invalid_ind, record)
+        if verbose:
+            print(logbook.stream)
+        if checkpoint is not None and checkpoint.due(gen, ngen):
+            checkpoint.save(gen, population, halloffame, logbook)
+
+    return population, logbook
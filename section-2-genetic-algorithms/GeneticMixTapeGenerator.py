@@ -1,14 +1,21 @@
-
 # Load prepared track metadata and features
 
 REQUIRED_GENRE = None #'Electronic'
 
-import pickle
-with open('tracks_metadata.pkl', 'rb') as f:
-    tracks_metadata = pickle.load(f)
-with open('track_features.pkl', 'rb') as f:
-    track_features = pickle.load(f)
-all_tracks = list(tracks_metadata.keys())
+# The tracks come from the columnar store written by GeneticMixTapeGeneratorPrep (see
+# MixTapeFeatureStore.py); a store is made from the pickles of older runs if there isn't one yet.
+# tracks_metadata and track_features are read-only views with the shape of the old pickled dicts.
+import os
+import time
+import numpy
+from MixTapeFeatureStore import FEATURE_STORE_PATH, loadFeatureStore, migratePickles
+
+start = time.time()
+if not os.path.exists(FEATURE_STORE_PATH):
+    migratePickles('.', FEATURE_STORE_PATH)
+store = loadFeatureStore(FEATURE_STORE_PATH)
+tracks_metadata = store.metadata
+track_features = store.features
 
 def computeTrackDuration(track):
     duration = tracks_metadata[track]['track_duration']
@@ -23,35 +30,23 @@ def computeTrackDuration(track):
         hours = 0
     return (float(hours) * 60.0 + float(mins) + float(secs)/60.0)
 
-# remove tracks that have missing keys
-removed_tracks = []
-for track in all_tracks:
-    if 'genres' not in track_features[track] or       'bpm' not in track_features[track] or       'beats_loudness' not in track_features[track] or       'loudness' not in track_features[track] or       'dissonance' not in track_features[track] or       'genres' not in track_features[track] or       'tonal_key' not in track_features[track] or       'interest' not in track_features[track] or       'listens' not in track_features[track] or       'favorites' not in track_features[track]:
-        del tracks_metadata[track]
-        del track_features[track]
-        removed_tracks.append(track)
-        continue
-    duration = computeTrackDuration(track)
-    if duration < 3 or duration > 10:
-        del tracks_metadata[track]
-        del track_features[track]
-        removed_tracks.append(track)
-        continue
-    if REQUIRED_GENRE is not None:
-        if REQUIRED_GENRE not in track_features[track]['genres']:
-            missing_required_genre = True
-            del tracks_metadata[track]
-            del track_features[track]
-            removed_tracks.append(track)
-all_tracks = list(set(all_tracks)-set(removed_tracks))
+# keep tracks that have every feature and last 3-10 minutes; store rows are sorted by track name,
+# so every process (and every evaluation node, see EVAL_BACKEND) numbers the tracks alike
+keep = store.complete() & (store.duration >= 3) & (store.duration <= 10)
+if REQUIRED_GENRE is not None:
+    keep &= store.hasGenre(REQUIRED_GENRE)
+track_rows = numpy.flatnonzero(keep)
+store_tracks = store.tracks.tolist()
+all_tracks = [store_tracks[row] for row in track_rows]
+print("Loaded %d tracks, %d after filtering, in %.2f seconds" % (len(store), len(all_tracks), time.time() - start))
 
-import numpy
 import random
 import sys
 from deap import algorithms
 from deap import base
 from deap import creator
 from deap import tools
+import EvolutionLoop
 
 # To evaluate an individual (a playlist), we'll compute a variety of scores:
 # 
@@ -149,23 +144,126 @@ def evalPlaylist(individual, desired_play_time):
 def validPlaylist(individual):
     return len(individual) >= 3 and len(set(individual)) == len(individual)
 
+# Columnar copies of the features used by the fitness function: row i of each array describes
+# all_tracks[i]. Genres and tonal keys are count matrices with one column per genre/key name,
+# so the entropies of a whole population come from one sum over the rows of its tracks.
+track_index = {track: i for (i, track) in enumerate(all_tracks)}
+genre_names = store.genre_names
+key_names = store.key_names
+
+track_durations = numpy.array(store.duration[track_rows])
+track_bpm = numpy.array(store.numeric['bpm'][track_rows])
+track_loudness = numpy.array(store.numeric['loudness'][track_rows])
+track_beats_loudness = numpy.array(store.numeric['beats_loudness'][track_rows])
+track_dissonance = numpy.array(store.numeric['dissonance'][track_rows])
+track_interest = numpy.array(store.numeric['interest'][track_rows])
+track_listens = numpy.array(store.numeric['listens'][track_rows])
+track_favorites = numpy.array(store.numeric['favorites'][track_rows])
+track_genres = numpy.zeros((len(all_tracks), len(genre_names)), dtype=numpy.uint8)
+numpy.add.at(track_genres, store.genreEntries(track_rows), 1)
+track_keys = numpy.zeros((len(all_tracks), len(key_names)), dtype=numpy.uint8)
+track_keys[numpy.arange(len(all_tracks)), store.tonal_key[track_rows]] = 1
+
+# calcEntropy adds -p*log(p) once per occurrence of a value, i.e. count times
+def countsEntropy(counts, lengths):
+    p = counts / lengths[:, None]
+    return -(counts * p * numpy.log(numpy.where(counts > 0, p, 1.0))).sum(axis=1)
+
+# The objectives of a playlist come from its totals, a row of TOTALS_SIZE numbers: the sums of
+# its durations, interests, listens and favorites, the sum of the BPM differences of successive
+# tracks, the least and the greatest beats loudness, loudness and dissonance, and the counts of
+# each genre and tonal key. evalTrackIds computes them from the tracks; INCREMENTAL_EVAL (below)
+# updates a parent's for a mutation or crossover.
+TOTAL_SUMS = slice(0, 4)
+TOTAL_BPM = 4
+TOTAL_MINIMUMS = slice(5, 8)
+TOTAL_MAXIMUMS = slice(8, 11)
+TOTAL_GENRES = slice(11, 11 + len(genre_names))
+TOTAL_KEYS = slice(11 + len(genre_names), 11 + len(genre_names) + len(key_names))
+TOTALS_SIZE = 11 + len(genre_names) + len(key_names)
+
+# the totals of many playlists at once; ids holds the track indices of all playlists one after
+# another and lengths the number of tracks in each (at least 1)
+def playlistTotals(ids, lengths):
+    starts = numpy.zeros(len(lengths), dtype=numpy.intp)
+    numpy.cumsum(lengths[:-1], out=starts[1:])
+    totals = numpy.empty((len(lengths), TOTALS_SIZE))
+    for (i, values) in enumerate([track_durations, track_interest, track_listens, track_favorites]):
+        totals[:, i] = numpy.add.reduceat(values[ids], starts)
+
+    # differences between successive tracks, with those across two playlists zeroed
+    bpm = track_bpm[ids]
+    diff_bpm = numpy.zeros(len(ids))
+    diff_bpm[1:] = numpy.abs(bpm[1:] - bpm[:-1])
+    diff_bpm[starts] = 0.0
+    totals[:, TOTAL_BPM] = numpy.add.reduceat(diff_bpm, starts)
+
+    for (i, values) in enumerate([track_beats_loudness, track_loudness, track_dissonance]):
+        totals[:, TOTAL_MINIMUMS.start + i] = numpy.minimum.reduceat(values[ids], starts)
+        totals[:, TOTAL_MAXIMUMS.start + i] = numpy.maximum.reduceat(values[ids], starts)
+    totals[:, TOTAL_GENRES] = numpy.add.reduceat(track_genres[ids], starts, dtype=numpy.int64)
+    totals[:, TOTAL_KEYS] = numpy.add.reduceat(track_keys[ids], starts, dtype=numpy.int64)
+    return totals
+
+# the ten objectives of evalPlaylist for playlists of the given totals and lengths
+def totalsObjectives(totals, lengths, desired_play_time):
+    n = lengths.astype(float)
+    # evalPlaylist starts its maximums at 0.0, so negative values (loudness) have a max of 0.0
+    ranges = numpy.maximum(totals[:, TOTAL_MAXIMUMS], 0.0) - totals[:, TOTAL_MINIMUMS]
+    return numpy.column_stack((numpy.abs(totals[:, 0] - desired_play_time),
+                               countsEntropy(totals[:, TOTAL_GENRES], n),
+                               countsEntropy(totals[:, TOTAL_KEYS], n),
+                               totals[:, TOTAL_BPM], ranges,
+                               totals[:, 1:4] / n[:, None]))
+
+# the ten objectives of evalPlaylist for many playlists at once, as for playlistTotals
+def evalTrackIds(ids, lengths, desired_play_time):
+    return totalsObjectives(playlistTotals(ids, lengths), lengths, desired_play_time)
+
+# batched replacement for the DeltaPenalty-wrapped evalPlaylist: scores a list of playlists in
+# one vectorized call, with invalid playlists getting invalidPlaylistScore
+def evalPlaylists(individuals, desired_play_time):
+    (scores, valid, ids, lengths) = playlistTrackIds(individuals)
+    if len(valid) > 0:
+        scores[valid] = evalTrackIds(ids, lengths, desired_play_time)
+    return [tuple(score) for score in scores.tolist()]
+
+# invalidPlaylistScore for every playlist, and the positions and track indices of the valid ones
+def playlistTrackIds(individuals):
+    scores = numpy.empty((len(individuals), len(invalidPlaylistScore)))
+    scores[:] = invalidPlaylistScore
+    valid = [i for (i, individual) in enumerate(individuals) if validPlaylist(individual)]
+    ids = numpy.fromiter((track_index[track] for i in valid for track in individuals[i]), dtype=numpy.intp)
+    lengths = numpy.array([len(individuals[i]) for i in valid], dtype=numpy.intp)
+    return (scores, valid, ids, lengths)
+
 creator.create("FitnessMulti", base.Fitness,
                weights=(-1.0, -1.0, -1.0, -1.0, -1.0, -1.0, -1.0, 1.0, 1.0, 1.0))
 
 creator.create("Individual", list, fitness=creator.FitnessMulti)
 
-# adds or removes a track not already in the playlist, at a random location
+# adds or removes a track not already in the playlist, at a random location; a playlist with a
+# state (see INCREMENTAL_EVAL) passes it on, updated for the change
 def mutatePlaylist(individual):
+    state = getattr(individual, 'state', None)
     if random.random() > 0.5:
         # add a track
         track = random.choice(all_tracks)
         if track not in individual:
             idx = random.choice(range(0, len(individual)))
+            if state is not None:
+                state.insert(individual, idx, track)
             individual = individual[:idx] + [track] + individual[idx:]
     elif len(individual) > 5:
         # delete a track
-        del individual[random.choice(range(0, len(individual)))]
-    return creator.Individual(individual),
+        idx = random.choice(range(0, len(individual)))
+        if state is not None:
+            state.delete(individual, idx)
+        del individual[idx]
+    mutant = creator.Individual(individual)
+    if state is not None:
+        mutant.state = state
+    return mutant,
 
 NUM_SONGS = 20
 
@@ -182,6 +280,722 @@ toolbox.register("mate", tools.cxOnePoint)
 toolbox.register("mutate", mutatePlaylist)
 toolbox.register("select", tools.selNSGA2)
 
+# a list of playlists in one vectorized call; PlaylistEvaluator below sends the offspring here
+toolbox.register("evaluate_batch", evalPlaylists, desired_play_time=120)
+
+# check evalPlaylists against evalPlaylist and time one generation's worth of evaluations
+BENCHMARK_EVAL = False
+
+if BENCHMARK_EVAL:
+    import time
+    playlists = []
+    for i in range(1000):
+        playlist = toolbox.individual()
+        for j in range(random.randint(0, 30)):
+            playlist, = mutatePlaylist(playlist)
+        if random.random() < 0.05:
+            playlist = playlist[:random.randint(0, 2)] # too short
+        elif random.random() < 0.05:
+            playlist = playlist + playlist[:1] # repeated song
+        playlists.append(creator.Individual(playlist))
+    # evalPlaylist reads plain dicts, as it did when they were unpickled
+    used = set(track for playlist in playlists for track in playlist)
+    (store_metadata, store_features) = (tracks_metadata, track_features)
+    tracks_metadata = {track: store_metadata[track] for track in used}
+    track_features = {track: store_features[track] for track in used}
+    expected = numpy.array([toolbox.evaluate(playlist) for playlist in playlists])
+    batched = numpy.array(toolbox.evaluate_batch(playlists))
+    print("Parity with evalPlaylist on %d playlists: %s (max relative difference %.2g)" %
+          (len(playlists), numpy.allclose(expected, batched, rtol=1e-9, atol=1e-9),
+           numpy.max(numpy.abs(expected - batched) / numpy.maximum(numpy.abs(expected), 1.0))))
+    for size in [50, 500, 5000]:
+        generation = playlists[:size] if size <= len(playlists) else [random.choice(playlists) for i in range(size)]
+        reps = max(1, 10000 // size)
+        start = time.time()
+        for i in range(reps):
+            list(map(toolbox.evaluate, generation))
+        serial = (time.time() - start) / reps
+        start = time.time()
+        for i in range(reps):
+            toolbox.evaluate_batch(generation)
+        vectorized = (time.time() - start) / reps
+        print("%d playlists per generation: evalPlaylist %.2f ms, evalPlaylists %.2f ms (%.1fx)" %
+              (size, serial * 1000, vectorized * 1000, serial / vectorized))
+    (tracks_metadata, track_features) = (store_metadata, store_features)
+
+# Incremental evaluation. A mutation adds or deletes a single track and a crossover swaps the
+# tails of two playlists, so with INCREMENTAL_EVAL every playlist scored in this process gets a
+# PlaylistState (as its state attribute): its totals, plus its values of each feature that has a
+# range, each row sorted, so that the least and greatest stay known as values come and go.
+# mutatePlaylist updates the state for the track it adds or deletes, and matePlaylists moves the
+# swapped segments between the states of the two parents (the tails, or if they are longer, the
+# heads, swapping the states first): the totals change by the rows of the k tracks moved, and
+# the sorted values by k binary searches and one splice, so the least and greatest are read off
+# the ends. As DEAP's operators do, both change the clones varOr hands them in place; deepcopy
+# copies a state. Playlists without a state, and batches sent to the workers, are evaluated from
+# their tracks. It pays on long playlists bred mostly by mutation: a crossover moves a quarter of
+# a playlist on average, which costs about as much as scoring it again (see BENCHMARK_INCREMENTAL).
+INCREMENTAL_EVAL = False
+
+# each track's share of the totals (nothing for the BPM differences and ranges)
+track_totals = numpy.zeros((len(all_tracks), TOTALS_SIZE))
+track_totals[:, TOTAL_SUMS] = numpy.column_stack((track_durations, track_interest, track_listens, track_favorites))
+track_totals[:, TOTAL_GENRES] = track_genres
+track_totals[:, TOTAL_KEYS] = track_keys
+track_ranges = numpy.column_stack((track_beats_loudness, track_loudness, track_dissonance))
+
+def trackIds(tracks):
+    return numpy.fromiter((track_index[track] for track in tracks), dtype=numpy.intp, count=len(tracks))
+
+# the sum of BPM differences of successive tracks
+def bpmDifferences(ids):
+    return float(numpy.abs(numpy.diff(track_bpm[ids])).sum())
+
+# how much the sum of BPM differences grows when a track of the given BPM goes between the tracks
+# at positions before and after (either of which may be outside the playlist)
+def bpmDifferenceChange(individual, before, after, bpm):
+    neighbours = [track_bpm[track_index[individual[j]]] for j in (before, after) if 0 <= j < len(individual)]
+    change = sum(abs(bpm - neighbour) for neighbour in neighbours)
+    if len(neighbours) == 2:
+        change -= abs(neighbours[0] - neighbours[1])
+    return change
+
+class PlaylistState:
+    def __init__(self, totals, ranges):
+        self.totals = totals
+        self.ranges = ranges # beats loudness, loudness and dissonance values, each row sorted
+
+    def __deepcopy__(self, memo):
+        return PlaylistState(self.totals.copy(), self.ranges.copy())
+
+    # takes the tracks of removed out and puts those of added in (arrays of track indices), with
+    # the sum of BPM differences changing by bpm_change
+    def change(self, removed, added, bpm_change):
+        self.totals += track_totals[added].sum(axis=0) - track_totals[removed].sum(axis=0)
+        self.totals[TOTAL_BPM] += bpm_change
+        ranges = self.ranges
+        if len(removed) > 0:
+            # the first of equal values goes first, the next one after it, and so on
+            old = numpy.sort(track_ranges[removed], axis=0).T
+            ties = numpy.arange(len(removed))
+            positions = [row * ranges.shape[1] + numpy.searchsorted(ranges[row], old[row]) + ties -
+                         numpy.searchsorted(old[row], old[row]) for row in range(len(ranges))]
+            ranges = numpy.delete(ranges, numpy.concatenate(positions)).reshape(len(ranges), -1)
+        if len(added) > 0:
+            new = numpy.sort(track_ranges[added], axis=0).T
+            positions = [row * ranges.shape[1] + numpy.searchsorted(ranges[row], new[row])
+                         for row in range(len(ranges))]
+            ranges = numpy.insert(ranges, numpy.concatenate(positions), new.ravel()).reshape(len(ranges), -1)
+        self.ranges = ranges
+        self.totals[TOTAL_MINIMUMS] = ranges[:, 0]
+        self.totals[TOTAL_MAXIMUMS] = ranges[:, -1]
+
+    # track is put in before position idx of individual
+    def insert(self, individual, idx, track):
+        i = track_index[track]
+        self.change(NO_TRACKS, numpy.array([i]), bpmDifferenceChange(individual, idx - 1, idx, track_bpm[i]))
+
+    # the track at position idx of individual is taken out
+    def delete(self, individual, idx):
+        i = track_index[individual[idx]]
+        self.change(numpy.array([i]), NO_TRACKS, -bpmDifferenceChange(individual, idx - 1, idx + 1, track_bpm[i]))
+
+NO_TRACKS = numpy.zeros(0, dtype=numpy.intp)
+
+# the states of playlists with the given totals (from playlistTotals) and tracks
+def playlistStates(totals, ids, lengths):
+    starts = numpy.concatenate(([0], numpy.cumsum(lengths)))
+    return [PlaylistState(row.copy(), numpy.sort(track_ranges[ids[starts[j] : starts[j + 1]]], axis=0).T.copy())
+            for (j, row) in enumerate(totals)]
+
+# tools.cxOnePoint, making the same random call, that also hands the parents' states on to the
+# children: child 1 is the head of ind1 and the tail of ind2, i.e. ind1 with its tail replaced
+# or ind2 with its head replaced, and likewise for child 2
+def matePlaylists(ind1, ind2):
+    size = min(len(ind1), len(ind2))
+    cxpoint = random.randint(1, size - 1)
+    (state1, state2) = (getattr(ind1, 'state', None), getattr(ind2, 'state', None))
+    if state1 is None or state2 is None:
+        (ind1.state, ind2.state) = (None, None)
+    else:
+        bpm = lambda track: track_bpm[track_index[track]]
+        # the differences across the crossover point, before and after the swap
+        (joint1, joint2) = (abs(bpm(ind1[cxpoint - 1]) - bpm(ind1[cxpoint])), abs(bpm(ind2[cxpoint - 1]) - bpm(ind2[cxpoint])))
+        (new_joint1, new_joint2) = (abs(bpm(ind1[cxpoint - 1]) - bpm(ind2[cxpoint])), abs(bpm(ind2[cxpoint - 1]) - bpm(ind1[cxpoint])))
+        if 2 * cxpoint < len(ind1) + len(ind2) - 2 * cxpoint:
+            (segment1, segment2) = (trackIds(ind1[:cxpoint]), trackIds(ind2[:cxpoint]))
+            (ind1.state, ind2.state) = (state2, state1)
+            inner = bpmDifferences(segment1) - bpmDifferences(segment2)
+            state2.change(segment2, segment1, inner + new_joint1 - joint2)
+            state1.change(segment1, segment2, -inner + new_joint2 - joint1)
+        else:
+            (segment1, segment2) = (trackIds(ind1[cxpoint:]), trackIds(ind2[cxpoint:]))
+            inner = bpmDifferences(segment2) - bpmDifferences(segment1)
+            state1.change(segment1, segment2, inner + new_joint1 - joint1)
+            state2.change(segment2, segment1, -inner + new_joint2 - joint2)
+    (ind1[cxpoint:], ind2[cxpoint:]) = (ind2[cxpoint:], ind1[cxpoint:])
+    return (ind1, ind2)
+
+if INCREMENTAL_EVAL:
+    toolbox.register("mate", matePlaylists)
+
+# Evaluation backends. eaMuPlusLambda scores the offspring with toolbox.map(toolbox.evaluate,
+# offspring), which PlaylistEvaluator.map turns into batches of evalTrackIds:
+#   'serial' - evaluated in this process
+#   'pool'   - a pool of NUM_WORKERS processes; the feature tables are copied into shared memory
+#              once and attached by every worker, so tasks carry only track indices
+#   'broker' - this process listens at BROKER_ADDRESS and hands out tasks to the evaluation nodes
+#              that connect to it; BROKER_LOCAL_WORKERS local processes stand in for the nodes.
+#              To add a machine, copy the feature files there and run this script with
+#              BROKER_WORKER = True and this machine's address (which must then be an
+#              external interface rather than 127.0.0.1).
+# A batch is split into one chunk per worker, but only if each chunk takes longer to evaluate than
+# to send out and get back (EVAL_DISPATCH_COST seconds, see BENCHMARK_PARALLEL); otherwise it is
+# evaluated here. The cost of a playlist is measured on the batches evaluated here (the first one
+# always is), and the workers are started by the first batch worth splitting, so a run whose
+# offspring batches are too small for them (the 50 playlists of LAMBDA take about 0.3 ms to
+# evaluate) never starts any.
+import multiprocessing
+import socket
+import threading
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client, wait, AuthenticationError
+
+EVAL_BACKEND = 'serial'
+NUM_WORKERS = multiprocessing.cpu_count()
+EVAL_DISPATCH_COST = 0.002 # seconds
+BROKER_ADDRESS = ('127.0.0.1', 50000)
+BROKER_AUTHKEY = b'mixtape'
+BROKER_WORKER = False
+BROKER_LOCAL_WORKERS = NUM_WORKERS
+EVAL_REPORT_INTERVAL = 500 # generations between evaluation time reports
+
+FEATURE_TABLES = ['track_durations', 'track_bpm', 'track_loudness', 'track_beats_loudness',
+                  'track_dissonance', 'track_interest', 'track_listens', 'track_favorites',
+                  'track_genres', 'track_keys']
+
+# copies the feature tables into shared memory; returns the segments (to unlink when the workers
+# are done) and (table, segment name, shape, dtype) for attachFeatureTables
+def shareFeatureTables():
+    segments = []
+    specs = []
+    for name in FEATURE_TABLES:
+        table = globals()[name]
+        segment = shared_memory.SharedMemory(create=True, size=max(1, table.nbytes))
+        numpy.ndarray(table.shape, dtype=table.dtype, buffer=segment.buf)[:] = table
+        segments.append(segment)
+        specs.append((name, segment.name, table.shape, table.dtype.str))
+    return (segments, specs)
+
+# pool worker initializer: replaces the worker's feature tables with views of the shared ones
+def attachFeatureTables(specs):
+    global feature_segments
+    feature_segments = []
+    for (name, segment_name, shape, dtype) in specs:
+        segment = shared_memory.SharedMemory(name=segment_name)
+        globals()[name] = numpy.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        feature_segments.append(segment)
+
+def evalTrackChunk(task):
+    (ids, lengths, desired_play_time) = task
+    return evalTrackIds(ids, lengths, desired_play_time)
+
+# multiprocessing sends messages over 16 KB as a header and a body; without TCP_NODELAY the body
+# waits for the header's delayed ACK (40 ms on Linux) on every mid-sized task and result
+def setNoDelay(connection):
+    sock = socket.fromfd(connection.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.close()
+
+# an evaluation node: evaluates the tasks the broker sends until told to stop or the broker goes away
+def brokerWorker(address, authkey):
+    connection = Client(address, authkey=authkey)
+    setNoDelay(connection)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        connection.send(evalTrackChunk(task))
+    connection.close()
+
+# hands out tasks to the evaluation nodes connected to it, one task per node at a time; the tasks of
+# a node that disconnects go to the others, or are evaluated here if none are left
+class Broker:
+    def __init__(self, address, authkey):
+        self.listener = Listener(address, authkey=authkey)
+        self.nodes = []
+        self.lock = threading.Lock()
+        self.closing = False
+        self.acceptor = threading.Thread(target=self.acceptNodes, daemon=True)
+        self.acceptor.start()
+
+    def acceptNodes(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError):
+                if self.closing:
+                    break
+                continue
+            if self.closing:
+                connection.close()
+                break
+            setNoDelay(connection)
+            with self.lock:
+                self.nodes.append(connection)
+
+    def dropNode(self, node):
+        with self.lock:
+            self.nodes.remove(node)
+        node.close()
+
+    def run(self, tasks):
+        results = [None] * len(tasks)
+        todo = list(reversed(range(len(tasks))))
+        busy = {}
+        with self.lock:
+            idle = list(self.nodes)
+        while len(todo) > 0 or len(busy) > 0:
+            while len(todo) > 0 and len(idle) > 0:
+                node = idle.pop()
+                try:
+                    node.send(tasks[todo[-1]])
+                    busy[node] = todo.pop()
+                except OSError:
+                    self.dropNode(node)
+            if len(busy) == 0:
+                for j in todo:
+                    results[j] = evalTrackChunk(tasks[j])
+                break
+            for node in wait(list(busy)):
+                j = busy.pop(node)
+                try:
+                    results[j] = node.recv()
+                    idle.append(node)
+                except (EOFError, OSError):
+                    todo.append(j)
+                    self.dropNode(node)
+        return results
+
+    def close(self):
+        # accept() doesn't return when the listener is closed, so wake it with a connection
+        self.closing = True
+        socket.create_connection(self.listener.address).close()
+        self.acceptor.join()
+        self.listener.close()
+        with self.lock:
+            nodes = list(self.nodes)
+        for node in nodes:
+            try:
+                node.send(None)
+            except OSError:
+                pass
+            self.dropNode(node)
+
+# Fitness cache. Many offspring are copies of playlists that were already scored: a mutation that
+# picks a track already in the playlist changes nothing, and so does a crossover of two equal
+# parents. PlaylistEvaluator looks each playlist up by its ordered tuple of tracks in an
+# EvolutionLoop.FitnessCache before scoring the batch, which keeps the FITNESS_CACHE_SIZE most
+# recently used fitnesses (0 turns the cache off).
+FITNESS_CACHE_SIZE = 100000
+
+class PlaylistEvaluator:
+    def __init__(self, backend, num_workers, desired_play_time, report_interval=EVAL_REPORT_INTERVAL,
+                 cache_size=FITNESS_CACHE_SIZE, incremental=INCREMENTAL_EVAL):
+        self.backend = backend
+        self.incremental = incremental
+        self.num_workers = num_workers
+        self.desired_play_time = desired_play_time
+        self.report_interval = report_interval
+        self.cache = EvolutionLoop.FitnessCache(cache_size) if cache_size > 0 else None
+        self.times = [] # seconds spent on each batch; batch 0 is the initial population
+        self.counts = [] # playlists in each batch
+        self.evaluations = [] # playlists in each batch that were actually scored (not cached)
+        self.playlist_cost = None # seconds per playlist, the least seen on a batch evaluated here
+        self.started = False
+
+    def start(self):
+        if self.backend == 'pool':
+            (self.segments, specs) = shareFeatureTables()
+            self.pool = multiprocessing.Pool(self.num_workers, initializer=attachFeatureTables, initargs=(specs,))
+        elif self.backend == 'broker':
+            self.broker = Broker(BROKER_ADDRESS, BROKER_AUTHKEY)
+            self.workers = [multiprocessing.Process(target=brokerWorker, args=(BROKER_ADDRESS, BROKER_AUTHKEY))
+                            for i in range(BROKER_LOCAL_WORKERS)]
+            for worker in self.workers:
+                worker.start()
+        self.started = True
+
+    def evaluate(self, individuals):
+        start = time.time()
+        if self.cache is None:
+            (fitnesses, scored) = (self.score(individuals), len(individuals))
+        else:
+            (fitnesses, scored) = self.cache.evaluate(individuals, self.score)
+        self.times.append(time.time() - start)
+        self.counts.append(len(individuals))
+        self.evaluations.append(scored)
+        generation = len(self.times) - 1
+        if self.report_interval and generation > 0 and generation % self.report_interval == 0:
+            recent = self.times[-self.report_interval:]
+            hits = sum(self.counts[-self.report_interval:]) - sum(self.evaluations[-self.report_interval:])
+            print("Generation %d: %d evaluations (%d cached) in %.2f ms (%.2f ms average and %d cache hits over the last %d generations)" %
+                  (generation, len(individuals), len(individuals) - self.evaluations[-1], self.times[-1] * 1000,
+                   sum(recent) / len(recent) * 1000, hits, len(recent)))
+        return fitnesses
+
+    # the number of playlists per worker if the batch is worth splitting, else None
+    def chunkSize(self, count):
+        if self.backend == 'serial' or self.playlist_cost is None:
+            return None
+        chunk_size = -(-count // self.num_workers)
+        if chunk_size == count or chunk_size * self.playlist_cost < EVAL_DISPATCH_COST:
+            return None
+        return chunk_size
+
+    def score(self, individuals):
+        if not self.incremental:
+            return self.scoreTracks(individuals)
+        # invalid playlists (a crossover can repeat a track) get their penalty from scoreTracks
+        updated = [getattr(individual, 'state', None) is not None and validPlaylist(individual)
+                   for individual in individuals]
+        mutants = [individual for (individual, u) in zip(individuals, updated) if u]
+        others = [individual for (individual, u) in zip(individuals, updated) if not u]
+        mutant_scores = []
+        if len(mutants) > 0:
+            lengths = numpy.array([len(individual) for individual in mutants], dtype=numpy.intp)
+            mutant_scores = totalsObjectives(numpy.array([individual.state.totals for individual in mutants]),
+                                             lengths, self.desired_play_time).tolist()
+        (mutant_scores, other_scores) = (iter(mutant_scores), iter(self.scoreTracks(others)))
+        return [tuple(next(mutant_scores)) if u else next(other_scores) for u in updated]
+
+    def scoreTracks(self, individuals):
+        (scores, valid, ids, lengths) = playlistTrackIds(individuals)
+        chunk_size = self.chunkSize(len(valid))
+        if chunk_size is None:
+            if len(valid) > 0:
+                start = time.time()
+                if self.incremental:
+                    totals = playlistTotals(ids, lengths)
+                    scores[valid] = totalsObjectives(totals, lengths, self.desired_play_time)
+                    for (i, state) in zip(valid, playlistStates(totals, ids, lengths)):
+                        individuals[i].state = state
+                else:
+                    scores[valid] = evalTrackIds(ids, lengths, self.desired_play_time)
+                cost = (time.time() - start) / len(valid)
+                self.playlist_cost = cost if self.playlist_cost is None else min(self.playlist_cost, cost)
+        else:
+            if not self.started:
+                self.start()
+            offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+            tasks = [(ids[offsets[i] : offsets[min(i + chunk_size, len(valid))]],
+                      lengths[i : i + chunk_size], self.desired_play_time)
+                     for i in range(0, len(valid), chunk_size)]
+            if self.backend == 'pool':
+                results = self.pool.map(evalTrackChunk, tasks, chunksize=1)
+            else:
+                results = self.broker.run(tasks)
+            scores[valid] = numpy.concatenate(results)
+        return [tuple(score) for score in scores.tolist()]
+
+    def map(self, func, individuals):
+        if func is toolbox.evaluate:
+            return self.evaluate(list(individuals))
+        return list(map(func, individuals))
+
+    def close(self):
+        if not self.started:
+            return
+        if self.backend == 'pool':
+            self.pool.close()
+            self.pool.join()
+            for segment in self.segments:
+                segment.close()
+                segment.unlink()
+        elif self.backend == 'broker':
+            self.broker.close()
+            for worker in self.workers:
+                worker.join()
+
+if BROKER_WORKER:
+    brokerWorker(BROKER_ADDRESS, BROKER_AUTHKEY)
+    sys.exit()
+
+# per-generation evaluation time of each backend for growing offspring batches (and whether the
+# batch was split among the workers), and the round trip of a one-playlist task to a worker, which
+# EVAL_DISPATCH_COST should be about
+BENCHMARK_PARALLEL = False
+
+if BENCHMARK_PARALLEL:
+    playlists = [toolbox.individual() for i in range(50000)]
+    serial_times = {}
+    serial_scores = {}
+    for backend in ['serial', 'pool', 'broker']:
+        evaluator = PlaylistEvaluator(backend, NUM_WORKERS, 120, report_interval=None, cache_size=0)
+        for size in [50, 500, 5000, 50000]:
+            reps = max(3, 50000 // size)
+            split = evaluator.chunkSize(size) is not None
+            start = time.time()
+            for i in range(reps):
+                scores = evaluator.evaluate(playlists[:size])
+            elapsed = (time.time() - start) / reps
+            serial_times.setdefault(size, elapsed)
+            serial_scores.setdefault(size, scores)
+            print("%s, %d playlists%s: %.2f ms per generation (%.1fx serial), same scores: %s" %
+                  (backend, size, " split" if split else "", elapsed * 1000, serial_times[size] / elapsed,
+                   scores == serial_scores[size]))
+        if backend != 'serial':
+            if not evaluator.started:
+                evaluator.start()
+            while backend == 'broker' and len(evaluator.broker.nodes) < BROKER_LOCAL_WORKERS:
+                time.sleep(0.01)
+            (scores, valid, ids, lengths) = playlistTrackIds(playlists[:1])
+            task = (ids, lengths, 120)
+            start = time.time()
+            for i in range(100):
+                if backend == 'pool':
+                    evaluator.pool.map(evalTrackChunk, [task])
+                else:
+                    evaluator.broker.run([task])
+            print("%s: %.2f ms per task round trip" % (backend, (time.time() - start) / 100 * 1000))
+        evaluator.close()
+
+# the time to breed and evaluate a generation of 50 offspring from 500 playlists of each length,
+# with and without INCREMENTAL_EVAL, by mutation alone and by half crossovers and half mutations;
+# both breed the same offspring, and a chain of 200 generations checks that their scores agree
+BENCHMARK_INCREMENTAL = False
+
+if BENCHMARK_INCREMENTAL:
+    for length in [20, 100, 1000]:
+        parents = [creator.Individual(random.sample(all_tracks, length)) for i in range(500)]
+        for (cxpb, mutpb) in [(0.0, 1.0), (0.5, 0.5)]:
+            (times, evaluation_times, scores) = ({}, {}, {})
+            for incremental in [False, True]:
+                toolbox.register("mate", matePlaylists if incremental else tools.cxOnePoint)
+                evaluator = PlaylistEvaluator('serial', 1, 120, report_interval=None, cache_size=0,
+                                              incremental=incremental)
+                population = [creator.Individual(parent) for parent in parents]
+                for (ind, fitness) in zip(population, evaluator.evaluate(population)):
+                    ind.fitness.values = fitness
+                random.seed(length)
+                scores[incremental] = []
+                start = time.time()
+                for generation in range(200):
+                    offspring = algorithms.varOr(population, toolbox, 50, cxpb, mutpb)
+                    for (ind, fitness) in zip(offspring, evaluator.evaluate(offspring)):
+                        ind.fitness.values = fitness
+                        scores[incremental].append(fitness)
+                    population = population[len(offspring):] + offspring
+                times[incremental] = (time.time() - start) / 200
+                evaluation_times[incremental] = sum(evaluator.times[1:]) / 200
+            (expected, updated) = (numpy.array(scores[False]), numpy.array(scores[True]))
+            print("%d tracks, CXPB=%.1f MUTPB=%.1f: %.2f ms per generation (%.2f ms evaluating), incremental "
+                  "%.2f ms (%.2f ms evaluating, %.1fx), same scores: %s (max relative difference %.2g)" %
+                  (length, cxpb, mutpb, times[False] * 1000, evaluation_times[False] * 1000,
+                   times[True] * 1000, evaluation_times[True] * 1000, times[False] / times[True],
+                   numpy.allclose(expected, updated, rtol=1e-9, atol=1e-9),
+                   numpy.max(numpy.abs(expected - updated) / numpy.maximum(numpy.abs(expected), 1.0))))
+    toolbox.register("mate", matePlaylists if INCREMENTAL_EVAL else tools.cxOnePoint)
+
+evaluator = PlaylistEvaluator(EVAL_BACKEND, NUM_WORKERS, 120)
+toolbox.register("map", evaluator.map)
+
+# Non-dominated sorting. tools.selNSGA2 and tools.ParetoFront compare every pair of fitnesses
+# with Fitness.dominates in Python, so selection grows quadratically with MU (and the Pareto
+# front of ten objectives grows without bound). selNSGA2Vectorized makes the same selection, in
+# the same order, from dominance matrices: the fitnesses are sorted best-first lexicographically
+# so that only earlier rows can dominate later ones, and the rank (front) of each row is one more
+# than the highest rank among the rows that dominate it, settled a block of rows at a time.
+# ParetoArchive keeps the hall of fame the same way and, given a maximum size, drops the most
+# crowded members once it grows past it (None keeps every non-dominated playlist, like
+# tools.ParetoFront).
+from operator import eq
+
+VECTORIZED_SELECTION = True
+ARCHIVE_SIZE = 1000
+DOMINANCE_BLOCK = 1 << 22 # pairs of fitnesses compared at a time
+
+# dominates[i, j]: a[i] is nowhere worse than b[j] and better somewhere; with distinct, the rows
+# of a and b are known to differ, so being nowhere worse is enough
+def dominanceMatrix(a, b, distinct=False):
+    dominates = numpy.ones((len(a), len(b)), dtype=bool)
+    for m in range(a.shape[1]):
+        dominates &= a[:, m, None] >= b[None, :, m]
+    if not distinct:
+        better = numpy.zeros((len(a), len(b)), dtype=bool)
+        for m in range(a.shape[1]):
+            better |= a[:, m, None] > b[None, :, m]
+        dominates &= better
+    return dominates
+
+# the front (0 = non-dominated) of each of a set of distinct weighted fitnesses
+def nondominatedRanks(wvalues):
+    n = len(wvalues)
+    order = numpy.lexsort(-wvalues[:, ::-1].T)
+    w = wvalues[order]
+    ranks = numpy.zeros(n, dtype=numpy.int32)
+    block = max(1, DOMINANCE_BLOCK // max(n, 1))
+    for start in range(0, n, block):
+        end = min(n, start + block)
+        # rows before a column are no worse on the first objective, so only the others are compared
+        dominates = dominanceMatrix(w[:end, 1:], w[start:end, 1:], distinct=True)
+        dominates[start:end] &= numpy.arange(start, end)[:, None] < numpy.arange(start, end)[None, :]
+        base = (dominates[:start] * (ranks[:start, None] + 1)).max(axis=0) if start > 0 else 0
+        inner = dominates[start:end]
+        block_ranks = numpy.zeros(end - start, dtype=numpy.int32) + base
+        while True:
+            settled = numpy.maximum(base, (inner * (block_ranks[:, None] + 1)).max(axis=0))
+            if numpy.array_equal(settled, block_ranks):
+                break
+            block_ranks = settled
+        ranks[start:end] = block_ranks
+    result = numpy.empty(n, dtype=numpy.int32)
+    result[order] = ranks
+    return result
+
+# tools.sortNondominated: the fronts, each in the order sortNondominated would list it, until
+# they hold k individuals
+def sortNondominatedVectorized(individuals, k, first_front_only=False):
+    if k == 0:
+        return []
+    fitness_individuals = {}
+    for ind in individuals:
+        fitness_individuals.setdefault(ind.fitness.wvalues, []).append(ind)
+    groups = list(fitness_individuals.values())
+    wvalues = numpy.array(list(fitness_individuals.keys()))
+    sizes = numpy.array([len(group) for group in groups])
+    ranks = nondominatedRanks(wvalues)
+    front = numpy.flatnonzero(ranks == 0)
+    fronts = [front]
+    sorted_count = sizes[front].sum()
+    if not first_front_only:
+        while sorted_count < min(len(individuals), k):
+            # sortNondominated adds a fitness to the next front as soon as the last fitness
+            # dominating it is taken off the current one, so the next front is ordered by the
+            # position of that fitness in the current front, then by first appearance
+            candidates = numpy.flatnonzero(ranks == len(fronts))
+            dominates = dominanceMatrix(wvalues[front], wvalues[candidates], distinct=True)
+            last = numpy.where(dominates, numpy.arange(len(front))[:, None], -1).max(axis=0)
+            front = candidates[numpy.lexsort((candidates, last))]
+            fronts.append(front)
+            sorted_count += sizes[front].sum()
+    return [[ind for i in front for ind in groups[i]] for front in fronts]
+
+# tools.assignCrowdingDist's distances, which sorts the objectives one after another with a
+# stable sort, starting from the order the previous objective left
+def crowdingDistances(values):
+    (n, nobj) = values.shape
+    distances = numpy.zeros(n)
+    order = numpy.arange(n)
+    for i in range(nobj):
+        order = order[numpy.argsort(values[order, i], kind='stable')]
+        sorted_values = values[order, i]
+        distances[order[0]] = float("inf")
+        distances[order[-1]] = float("inf")
+        if sorted_values[-1] == sorted_values[0]:
+            continue
+        with numpy.errstate(over='ignore', invalid='ignore'):
+            norm = nobj * float(sorted_values[-1] - sorted_values[0])
+            distances[order[1:-1]] += (sorted_values[2:] - sorted_values[:-2]) / norm
+    return distances
+
+def assignCrowdingDistVectorized(individuals):
+    if len(individuals) == 0:
+        return numpy.zeros(0)
+    distances = crowdingDistances(numpy.array([ind.fitness.values for ind in individuals]))
+    for (ind, dist) in zip(individuals, distances.tolist()):
+        ind.fitness.crowding_dist = dist
+    return distances
+
+def selNSGA2Vectorized(individuals, k):
+    pareto_fronts = sortNondominatedVectorized(individuals, k)
+    for front in pareto_fronts[:-1]:
+        assignCrowdingDistVectorized(front)
+    distances = assignCrowdingDistVectorized(pareto_fronts[-1])
+    chosen = [ind for front in pareto_fronts[:-1] for ind in front]
+    k = k - len(chosen)
+    if k > 0:
+        chosen.extend(pareto_fronts[-1][i] for i in numpy.argsort(-distances, kind='stable')[:k])
+    return chosen
+
+# tools.ParetoFront, optionally bounded to maxsize members
+class ParetoArchive(tools.ParetoFront):
+    def __init__(self, maxsize=None, similar=eq):
+        tools.ParetoFront.__init__(self, similar)
+        self.maxsize = maxsize
+
+    def update(self, population):
+        if len(population) == 0:
+            return
+        # the individuals ParetoFront.update would keep, one after another: those not dominated by
+        # the archive or the rest of the population and without a twin (an equal fitness and a
+        # similar individual) already in the archive
+        candidates = numpy.array([ind.fitness.wvalues for ind in population])
+        dominated = dominanceMatrix(candidates, candidates).any(axis=0)
+        if len(self) > 0:
+            members = numpy.array([ind.fitness.wvalues for ind in self.items])
+            dominated |= dominanceMatrix(members, candidates).any(axis=0)
+            removed = dominanceMatrix(candidates, members).any(axis=0)
+        else:
+            removed = numpy.zeros(0, dtype=bool)
+        for i in reversed(numpy.flatnonzero(removed).tolist()):
+            self.remove(i)
+        twins = {}
+        for ind in self.items:
+            twins.setdefault(ind.fitness.wvalues, []).append(ind)
+        for i in numpy.flatnonzero(~dominated).tolist():
+            ind = population[i]
+            same_fitness = twins.setdefault(ind.fitness.wvalues, [])
+            if not any(self.similar(ind, twin) for twin in same_fitness):
+                self.insert(ind)
+                same_fitness.append(ind)
+        if self.maxsize is not None and len(self) > self.maxsize:
+            distances = crowdingDistances(numpy.array([ind.fitness.values for ind in self.items]))
+            crowded = numpy.argsort(distances, kind='stable')[:len(self) - self.maxsize]
+            for i in sorted(crowded.tolist(), reverse=True):
+                self.remove(i)
+
+if VECTORIZED_SELECTION:
+    toolbox.register("select", selNSGA2Vectorized)
+
+# selection time of tools.selNSGA2 and selNSGA2Vectorized for MU + LAMBDA scored playlists, and
+# whether they select the same playlists in the same order; likewise for a Pareto front update
+BENCHMARK_SELECTION = False
+
+if BENCHMARK_SELECTION:
+    for (mu, lambda_) in [(500, 50), (5000, 500), (50000, 5000)]:
+        playlists = [toolbox.individual() for i in range(mu + lambda_)]
+        for (playlist, fitness) in zip(playlists, evalPlaylists(playlists, 120)):
+            playlist.fitness.values = fitness
+        start = time.time()
+        chosen = selNSGA2Vectorized(playlists, mu)
+        vectorized = time.time() - start
+        if mu <= 5000: # selNSGA2 would take over half an hour on 55000 playlists
+            start = time.time()
+            expected = tools.selNSGA2(playlists, mu)
+            serial = time.time() - start
+            print("MU=%d: selNSGA2 %.3f s, selNSGA2Vectorized %.3f s (%.0fx), same selection: %s" %
+                  (mu, serial, vectorized, serial / vectorized, [id(ind) for ind in chosen] == [id(ind) for ind in expected]))
+        else:
+            print("MU=%d: selNSGA2Vectorized %.3f s" % (mu, vectorized))
+        if mu <= 5000:
+            (front, archive) = (tools.ParetoFront(), ParetoArchive())
+            start = time.time()
+            front.update(playlists[:mu])
+            front.update(playlists[mu:])
+            serial = time.time() - start
+            start = time.time()
+            archive.update(playlists[:mu])
+            archive.update(playlists[mu:])
+            vectorized = time.time() - start
+            print("MU=%d: ParetoFront.update %.3f s, ParetoArchive.update %.3f s (%.0fx), same front: %s" %
+                  (mu, serial, vectorized, serial / vectorized,
+                   [ind.fitness.values for ind in front] == [ind.fitness.values for ind in archive] and
+                   [list(ind) for ind in front] == [list(ind) for ind in archive]))
+
 # Simulation parameters:
 # Number of generations
 NGEN = 5000
@@ -198,7 +1012,7 @@ MUTPB = 0.5
 pop = toolbox.population(n=MU)
 
 # The top playlist is the one that is best on all scores in the fitness
-hof = tools.ParetoFront()
+hof = ParetoArchive(ARCHIVE_SIZE) if VECTORIZED_SELECTION else tools.ParetoFront()
 
 # fitness is composed of:
 # 0: diff_play_time, 1: genre_entropy, 2: tonal_keys_entropy,
@@ -229,9 +1043,195 @@ stats = tools.MultiStatistics(time=diff_play_time_stats,
                               favs=avg_favorites_stats)
 stats.register("avg", numpy.mean, axis=0)
 
+# Island model. Instead of one population of MU, NUM_ISLANDS populations of MU/NUM_ISLANDS (with
+# LAMBDA/NUM_ISLANDS children each) evolve in their own processes with the same toolbox, so the
+# cores share the run, which does as many evaluations as the single population would; non-dominated
+# sorting a small population is also much cheaper than sorting one large one. Every
+# MIGRATION_INTERVAL generations each island sends its MIGRANTS best playlists (by toolbox.select)
+# to its neighbours, and selects its next population from its own and the arriving ones:
+#   'ring'     - island i sends to island i+1
+#   'complete' - every island sends to every other one
+# Each island keeps its own Pareto front; they are merged into the global front hof afterwards.
+# Islands evaluate serially in their process (EVAL_BACKEND is for the single population).
+# An island needs a population and an offspring batch big enough to evolve on its own, so there
+# are at most MAX_ISLANDS islands, each of at least MIN_ISLAND_MU playlists breeding at least
+# MIN_ISLAND_LAMBDA children a generation (5 with MU = 500 and LAMBDA = 50), and no more islands
+# than cores.
+ISLAND_MODEL = False
+MIN_ISLAND_MU = 100
+MIN_ISLAND_LAMBDA = 10
+MAX_ISLANDS = max(1, min(MU // MIN_ISLAND_MU, LAMBDA // MIN_ISLAND_LAMBDA))
+NUM_ISLANDS = min(multiprocessing.cpu_count(), MAX_ISLANDS)
+MIGRATION_TOPOLOGY = 'ring'
+MIGRATION_INTERVAL = 50
+MIGRANTS = 5
+
+def migrationTargets(topology, num_islands, island):
+    if topology == 'ring':
+        return [(island + 1) % num_islands] if num_islands > 1 else []
+    elif topology == 'complete':
+        return [i for i in range(num_islands) if i != island]
+    raise ValueError("Unknown migration topology %r" % topology)
+
+def newParetoFront():
+    return ParetoArchive(ARCHIVE_SIZE) if VECTORIZED_SELECTION else tools.ParetoFront()
+
+# runs in the island's process; puts (island, population, front, evaluations, CPU seconds) on results
+def runIsland(island, seed, inboxes, results, ngen, mu, lambda_, interval, migrants, topology):
+    cpu_start = time.process_time()
+    random.seed(seed)
+    island_evaluator = PlaylistEvaluator('serial', 1, 120, report_interval=None)
+    toolbox.register("map", island_evaluator.map)
+    population = toolbox.population(n=mu)
+    front = newParetoFront()
+    targets = migrationTargets(topology, len(inboxes), island)
+    sources = [i for i in range(len(inboxes)) if island in migrationTargets(topology, len(inboxes), i)]
+    arrived = {} # migrants by generation, from islands that got ahead
+    generation = 0
+    while generation < ngen:
+        generations = min(interval, ngen - generation)
+        algorithms.eaMuPlusLambda(population, toolbox, mu, lambda_, CXPB, MUTPB, generations,
+                                  halloffame=front, verbose=False)
+        generation += generations
+        if generation < ngen and len(sources) > 0:
+            emigrants = [toolbox.clone(ind) for ind in toolbox.select(population, migrants)]
+            for target in targets:
+                inboxes[target].put((generation, island, emigrants))
+            while len(arrived.get(generation, [])) < len(sources):
+                (sent, source, individuals) = inboxes[island].get()
+                arrived.setdefault(sent, []).append((source, individuals))
+            # in the order of the sending islands, so a run doesn't depend on which arrives first
+            immigrants = [ind for (source, individuals) in sorted(arrived.pop(generation), key=lambda m: m[0])
+                          for ind in individuals]
+            population[:] = toolbox.select(population + immigrants, mu)
+    results.put((island, population, list(front), sum(island_evaluator.counts), time.process_time() - cpu_start))
+
+# returns the merged population, each island's front, the global front, the number of evaluations
+# and the CPU time of the slowest island (the wall-clock time of the run given a core per island)
+def runIslands(num_islands, ngen, mu, lambda_, interval=MIGRATION_INTERVAL, migrants=MIGRANTS,
+               topology=MIGRATION_TOPOLOGY):
+    inboxes = [multiprocessing.Queue() for i in range(num_islands)]
+    results = multiprocessing.Queue()
+    islands = [multiprocessing.Process(target=runIsland,
+                                       args=(i, random.randrange(2**32), inboxes, results, ngen,
+                                             max(1, mu // num_islands), max(1, lambda_ // num_islands),
+                                             interval, migrants, topology))
+               for i in range(num_islands)]
+    for island in islands:
+        island.start()
+    finished = sorted(results.get() for i in range(num_islands))
+    for island in islands:
+        island.join()
+    population = [ind for (i, island_population, front, evaluations, cpu) in finished for ind in island_population]
+    island_fronts = [front for (i, island_population, front, evaluations, cpu) in finished]
+    global_front = newParetoFront()
+    for front in island_fronts:
+        global_front.update(front)
+    return (population, island_fronts, global_front, sum(result[3] for result in finished),
+            max(result[4] for result in finished))
+
+# Hypervolume: the share of the box between the best and worst values of the given fronts
+# (valid playlists only) that is dominated by each front, estimated from HYPERVOLUME_SAMPLES
+# random points in the box; ten objectives are far too many for an exact computation. The same
+# box and points are used for every front, so the results can be compared with each other.
+HYPERVOLUME_SAMPLES = 100000
+
+def hypervolumes(fronts, samples=HYPERVOLUME_SAMPLES, seed=0):
+    points = [-numpy.array([ind.fitness.wvalues for ind in front if validPlaylist(ind)]).reshape(-1, len(invalidPlaylistScore))
+              for front in fronts]
+    every = numpy.concatenate(points)
+    (low, high) = (every.min(axis=0), every.max(axis=0))
+    sample = numpy.random.RandomState(seed).uniform(low, high, size=(samples, len(low)))
+    volumes = []
+    for front in points:
+        dominated = numpy.zeros(samples, dtype=bool)
+        block = max(1, DOMINANCE_BLOCK // max(len(front), 1))
+        for start in range(0, samples, block):
+            end = min(samples, start + block)
+            covered = numpy.ones((len(front), end - start), dtype=bool)
+            for m in range(len(low)):
+                covered &= front[:, m, None] <= sample[None, start:end, m]
+            dominated[start:end] = covered.any(axis=0)
+        volumes.append(dominated.mean())
+    return volumes
+
+# wall-clock time and hypervolume of the single population and the island model on the same
+# number of generations and evaluations
+BENCHMARK_ISLANDS = False
+
+if BENCHMARK_ISLANDS:
+    BENCHMARK_NGEN = 1000
+    start = time.time()
+    single_population = toolbox.population(n=MU)
+    single_front = newParetoFront()
+    algorithms.eaMuPlusLambda(single_population, toolbox, MU, LAMBDA, CXPB, MUTPB, BENCHMARK_NGEN,
+                              halloffame=single_front, verbose=False)
+    single_time = time.time() - start
+    for (num_islands, topology) in [(2, 'ring'), (MAX_ISLANDS, 'ring'), (MAX_ISLANDS, 'complete')]:
+        start = time.time()
+        (island_population, island_fronts, global_front, evaluations, island_cpu) = runIslands(
+            num_islands, BENCHMARK_NGEN, MU, LAMBDA, topology=topology)
+        island_time = time.time() - start
+        (single_volume, island_volume) = hypervolumes([single_front, global_front])
+        print("%d generations: single population %.1f s, hypervolume %.4f; %d islands (%s) %.1f s "
+              "(slowest island %.1f s of CPU), hypervolume %.4f" %
+              (BENCHMARK_NGEN, single_time, single_volume, num_islands, topology, island_time, island_cpu, island_volume))
+
+# Per-generation telemetry of the single-population run (see EvolutionLoop.py): a JSON lines or
+# CSV file (by its extension) with the time of each phase of every generation, the evaluation,
+# cache and penalty counts and the objective averages, or None for no log; one generation in
+# every PROFILE_INTERVAL runs under cProfile (0 for none)
+GENERATION_LOG = None # e.g. 'mixtape-generations.jsonl'
+PROFILE_INTERVAL = 0
+
+# Checkpoints of the single-population run (see EvolutionLoop.py): every CHECKPOINT_INTERVAL
+# generations the run is saved to CHECKPOINT_PATH (None for no checkpoints), and with RESUME a run
+# continues from the checkpoint there, if there is one, to NGEN generations. The island model
+# can't be checkpointed, so it refuses to run with either set.
+CHECKPOINT_PATH = None # e.g. 'mixtape-checkpoint.pkl.gz'
+CHECKPOINT_INTERVAL = 100
+RESUME = False
+
 # run the simulation
-algorithms.eaMuPlusLambda(pop, toolbox, MU, LAMBDA, CXPB, MUTPB, NGEN,
-                          stats, halloffame=hof, verbose=False)
+if ISLAND_MODEL:
+    if CHECKPOINT_PATH is not None or RESUME:
+        raise ValueError("The island model can't be checkpointed or resumed: set CHECKPOINT_PATH = None "
+                         "and RESUME = False, or ISLAND_MODEL = False")
+    start = time.time()
+    (pop, island_fronts, hof, evaluations, island_cpu) = runIslands(NUM_ISLANDS, NGEN, MU, LAMBDA)
+    volumes = hypervolumes(island_fronts + [hof])
+    for (i, front) in enumerate(island_fronts):
+        print("Island %d: %d playlists in its Pareto front, hypervolume %.4f" % (i, len(front), volumes[i]))
+    print("Global Pareto front: %d playlists, hypervolume %.4f" % (len(hof), volumes[-1]))
+    print("Evaluated %d playlists on %d islands in %.1f seconds" % (evaluations, NUM_ISLANDS, time.time() - start))
+    evaluator.close()
+else:
+    resume = None
+    if RESUME and CHECKPOINT_PATH is not None and os.path.exists(CHECKPOINT_PATH):
+        resume = EvolutionLoop.loadCheckpoint(CHECKPOINT_PATH)
+        (pop, hof) = (resume['population'], resume['halloffame'])
+        print("Resuming from generation %d of %s" % (resume['gen'], CHECKPOINT_PATH))
+    checkpoint = None
+    if CHECKPOINT_PATH is not None:
+        checkpoint = EvolutionLoop.Checkpointer(CHECKPOINT_PATH, CHECKPOINT_INTERVAL)
+    log = None
+    if GENERATION_LOG is not None:
+        log = EvolutionLoop.GenerationLog(GENERATION_LOG,
+                                          scored=(lambda: evaluator.evaluations[-1]) if evaluator.cache is not None else None,
+                                          penalty=invalidPlaylistScore, profile_interval=PROFILE_INTERVAL,
+                                          append=resume is not None)
+    EvolutionLoop.eaMuPlusLambda(pop, toolbox, MU, LAMBDA, CXPB, MUTPB, NGEN,
+                                 stats, halloffame=hof, verbose=False, log=log,
+                                 checkpoint=checkpoint, resume=resume)
+    evaluator.close()
+    if checkpoint is not None:
+        checkpoint.close()
+    if log is not None:
+        log.close()
+        print("Generation phases: %s" % log.summary())
+    print("Evaluated %d playlists in %.1f seconds (%s backend), %d of them scored and %d from the fitness cache" %
+          (sum(evaluator.counts), sum(evaluator.times), EVAL_BACKEND, sum(evaluator.evaluations),
+           sum(evaluator.counts) - sum(evaluator.evaluations)))
 
 
 best = hof[0]
@@ -255,14 +1255,93 @@ print("Avg interest:", best.fitness.values[7])
 print("Avg listens:", best.fitness.values[8])
 print("Avg favorites:", best.fitness.values[9])
 
-# write playlist (copy songs and create m3u file, one song per line)
+# Write the playlists: an m3u file per playlist, one song per line, next to the songs in
+# EXPORT_DIR. The best playlist is playlist.m3u; with EXPORT_PLAYLISTS = 'front' every valid
+# playlist of the Pareto front is also written as playlist-<i>.m3u. A song is written once however
+# many playlists it's in, and not at all if EXPORT_DIR already has it with the same size and
+# modification time (so a second run writes only the new songs). Songs are named by their file
+# name, and a song whose file name another song already has gets a numbered one (track-2.mp3).
+# AUDIO_LINK picks how:
+#   'hardlink' - a hard link when the song is on the same filesystem as EXPORT_DIR, else a copy
+#   'symlink'  - a symbolic link to the song
+#   'copy'     - a copy
+# A song that can't be linked (the filesystem doesn't support it, or won't allow it) is copied.
+# Linking takes no I/O; copies run on COPY_THREADS threads, as they mostly wait on the disk.
 import os
-from shutil import copyfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-os.mkdir('output')
-with open('output/playlist.m3u', 'wt') as m3u:
-    for track in best:
-        trackmp3 = track.split('/')[3]
-        copyfile(track, 'output/%s' % trackmp3)
-        m3u.write('%s\n' % trackmp3)
+EXPORT_DIR = 'output'
+EXPORT_PLAYLISTS = 'best' # or 'front'
+AUDIO_LINK = 'hardlink'
+COPY_THREADS = 8
+
+def exportedAlready(source, target):
+    try:
+        (source_stat, target_stat) = (os.stat(source), os.stat(target))
+    except FileNotFoundError:
+        return False
+    # whole seconds, as some filesystems keep coarser times than others
+    return source_stat.st_size == target_stat.st_size and int(source_stat.st_mtime) == int(target_stat.st_mtime)
+
+# the track's file name, or a numbered one if another of the songs already has it
+def songName(track, songs):
+    name = os.path.basename(track)
+    (stem, extension) = os.path.splitext(name)
+    number = 1
+    while name in songs:
+        number += 1
+        name = '%s-%d%s' % (stem, number, extension)
+    return name
+
+# links track as target, returning whether it could
+def linkSong(track, target, audio_link, export_device):
+    try:
+        if audio_link == 'symlink':
+            os.symlink(os.path.abspath(track), target)
+        elif audio_link == 'hardlink' and os.stat(track).st_dev == export_device:
+            os.link(track, target)
+        else:
+            return False
+    except OSError:
+        return False
+    return True
+
+def exportPlaylists(playlists, export_dir=EXPORT_DIR, audio_link=AUDIO_LINK, copy_threads=COPY_THREADS):
+    """Writes each (name, tracks) playlist as export_dir/name.m3u with its songs; returns the
+    number of songs linked, copied and already there."""
+    os.makedirs(export_dir, exist_ok=True)
+    songs = {} # track by song name
+    names = {} # song name by track
+    for (name, tracks) in playlists:
+        with open(os.path.join(export_dir, name + '.m3u'), 'wt') as m3u:
+            for track in tracks:
+                if track not in names:
+                    names[track] = songName(track, songs)
+                    songs[names[track]] = track
+                m3u.write('%s\n' % names[track])
+    export_device = os.stat(export_dir).st_dev
+    (linked, present, copies) = (0, 0, [])
+    for (song, track) in songs.items():
+        target = os.path.join(export_dir, song)
+        if exportedAlready(track, target):
+            present += 1
+            continue
+        if os.path.lexists(target):
+            os.remove(target)
+        if linkSong(track, target, audio_link, export_device):
+            linked += 1
+        else:
+            copies.append((track, target))
+    with ThreadPoolExecutor(copy_threads) as pool:
+        # list() so that a failed copy raises here
+        list(pool.map(lambda copy: shutil.copy2(*copy), copies))
+    return (linked, len(copies), present)
 
+playlists = [('playlist', best)]
+if EXPORT_PLAYLISTS == 'front':
+    playlists += [('playlist-%03d' % i, playlist) for (i, playlist) in enumerate(hof) if validPlaylist(playlist)]
+start = time.time()
+(linked, copied, present) = exportPlaylists(playlists)
+print("Wrote %d playlists to %s in %.1f seconds: %d songs linked, %d copied and %d already there" %
+      (len(playlists), EXPORT_DIR, time.time() - start, linked, copied, present))
@@ -24,39 +24,37 @@ with open('fma/fma_metadata/raw_tracks.csv', encoding='utf-8') as fin:
 # Extract features for tracks
 from essentia.standard import *
 def extract_features(track):
-    try:
-        features, _ = MusicExtractor(lowlevelStats=['mean', 'stdev'],
-                                     rhythmStats=['mean', 'stdev'],
-                                     tonalStats=['mean', 'stdev'])(track)
-        genres = tracks_metadata[track]['track_genres']
-        listens = int(tracks_metadata[track]['track_listens'])
-        favorites = int(tracks_metadata[track]['track_favorites'])
-        interest = int(tracks_metadata[track]['track_interest'])
-        loudness = features['lowlevel.loudness_ebu128.integrated']
-        loudness_range = features['lowlevel.loudness_ebu128.loudness_range']
-        bpm = features['rhythm.bpm']
-        beats_loudness = features['rhythm.beats_loudness.mean']
-        tonal_key = features['tonal.key_edma.key']
-        tonal_scale = features['tonal.key_edma.scale'],
-        dissonance = features['lowlevel.dissonance.mean']
-        f = {'genres': genres,
-             'listens': listens,
-             'favorites': favorites,
-             'interest': interest,
-             'loudness': loudness,
-             'loudness_range': loudness_range,
-             'bpm': bpm,
-             'beats_loudness': beats_loudness,
-             'tonal_key': tonal_key,
-             'tonal_scale': tonal_scale,
-             'dissonance': dissonance
-            }
-    except:
-        f = {}
+    features, _ = MusicExtractor(lowlevelStats=['mean', 'stdev'],
+                                 rhythmStats=['mean', 'stdev'],
+                                 tonalStats=['mean', 'stdev'])(track)
+    genres = tracks_metadata[track]['track_genres']
+    listens = int(tracks_metadata[track]['track_listens'])
+    favorites = int(tracks_metadata[track]['track_favorites'])
+    interest = int(tracks_metadata[track]['track_interest'])
+    loudness = features['lowlevel.loudness_ebu128.integrated']
+    loudness_range = features['lowlevel.loudness_ebu128.loudness_range']
+    bpm = features['rhythm.bpm']
+    beats_loudness = features['rhythm.beats_loudness.mean']
+    tonal_key = features['tonal.key_edma.key']
+    tonal_scale = features['tonal.key_edma.scale']
+    dissonance = features['lowlevel.dissonance.mean']
+    f = {'genres': genres,
+         'listens': listens,
+         'favorites': favorites,
+         'interest': interest,
+         'loudness': loudness,
+         'loudness_range': loudness_range,
+         'bpm': bpm,
+         'beats_loudness': beats_loudness,
+         'tonal_key': tonal_key,
+         'tonal_scale': tonal_scale,
+         'dissonance': dissonance
+        }
     return f
 
 import random
 import time
+from collections import Counter
 ts = list(tracks_metadata.keys())
 random.shuffle(ts)
 
@@ -70,20 +68,155 @@ random.shuffle(ts)
 
 # required 285378 seconds actually (79 hours)
 
+# The extraction runs for days, so results are checkpointed as they come in: every track's
+# features (or the reason it failed) are appended to RESULTS_PATH, one JSON object per line,
+# and flushed to disk every CHECKPOINT_INTERVAL results. A rerun skips the tracks already in
+# the file, so after an interruption only the remaining ones are processed; set RETRY_FAILED to
+# try the recorded failures again on the next run.
+#
+# Each track is extracted in a process of its own (NUM_WORKERS at a time; starting one costs
+# nothing next to a track's extraction), so a worker that crashes inside essentia only loses
+# its own track, which is recorded with its exit code, and one that runs for longer than
+# TRACK_TIMEOUT seconds is killed and recorded as timed out. Only failures that can go away on
+# their own are retried, up to MAX_ATTEMPTS times: I/O and memory errors, and a worker killed
+# with SIGKILL (normally the kernel's out-of-memory killer). A decoding error or a segfault on
+# a file happens again every time, so those are recorded straight away.
+import collections
+import json
 import multiprocessing
-pool = multiprocessing.Pool(16)
-start = time.time()
-track_features_list = pool.map(extract_features, ts)
-track_features = dict(zip(ts, track_features_list))
-pool.close()
-pool.join() # see: https://stackoverflow.com/a/47683305
-end = time.time()
-print(end - start)
-
-# save results of all that processing
-import pickle
-with open('track_features.pkl', 'wb') as track_features_out:
-    pickle.dump(track_features, track_features_out)
-with open('tracks_metadata.pkl', 'wb') as track_metadata_out:
-    pickle.dump(tracks_metadata, track_metadata_out)
+import os
+import signal
+import sys
+import traceback
+from multiprocessing.connection import wait
+
+RESULTS_PATH = 'track_features.jsonl'
+NUM_WORKERS = 16
+CHECKPOINT_INTERVAL = 16 # results between flushes of RESULTS_PATH
+TRACK_TIMEOUT = 1800 # seconds
+MAX_ATTEMPTS = 2
+TRANSIENT_ERRORS = (OSError, MemoryError)
+RETRY_FAILED = False
+PROGRESS_INTERVAL = 10 # seconds between progress updates
+
+# track -> latest result record in RESULTS_PATH; a line cut short by a crash is skipped
+def load_results(path):
+    results = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as fin:
+            for line in fin:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                results[record['track']] = record
+    return results
+
+# runs in a worker process; sends the track's record back through conn
+def extract_track(track, attempt, conn):
+    try:
+        record = {'track': track, 'features': extract_features(track), 'attempts': attempt}
+    except Exception as e:
+        record = {'track': track, 'error': '%s: %s' % (type(e).__name__, e),
+                  'traceback': traceback.format_exc(limit=3), 'attempts': attempt,
+                  'transient': isinstance(e, TRANSIENT_ERRORS)}
+    conn.send(record)
+    conn.close()
+
+def start_track(track, attempt):
+    (reader, writer) = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=extract_track, args=(track, attempt, writer), daemon=True)
+    process.start()
+    writer.close() # so the reader sees the end of the pipe if the worker dies
+    return (reader, (process, track, attempt, time.time()))
+
+# the record of a finished (or timed out) worker, or None to retry its track
+def finish_track(reader, job, timed_out):
+    (process, track, attempt, started) = job
+    record = None
+    if timed_out:
+        process.kill()
+    else:
+        try:
+            record = reader.recv()
+        except EOFError: # the worker died without sending anything
+            pass
+    reader.close()
+    process.join()
+    if timed_out:
+        return {'track': track, 'error': 'timed out after %d seconds' % TRACK_TIMEOUT, 'attempts': attempt}
+    if record is None:
+        if process.exitcode == -signal.SIGKILL and attempt < MAX_ATTEMPTS:
+            return None
+        return {'track': track, 'error': 'worker died (exit code %d)' % process.exitcode, 'attempts': attempt}
+    if record.pop('transient', False) and attempt < MAX_ATTEMPTS:
+        return None
+    return record
+
+def format_duration(seconds):
+    (hours, rest) = divmod(int(seconds), 3600)
+    return '%d:%02d:%02d' % (hours, rest // 60, rest % 60)
+
+def extract_all_features(tracks, results_path, num_workers):
+    results = load_results(results_path)
+    todo = [track for track in tracks
+            if track not in results or (RETRY_FAILED and 'error' in results[track])]
+    print("%d tracks, %d already extracted or failed, %d to do" % (len(tracks), len(tracks) - len(todo), len(todo)))
+    queue = collections.deque((track, 1) for track in todo)
+    running = {} # reader -> (process, track, attempt, start time)
+    start = time.time()
+    last_progress = 0
+    done = 0
+    failed = 0
+    with open(results_path, 'a', encoding='utf-8') as out:
+        if out.tell() > 0:
+            out.write('\n') # ends a line cut short by a crash (an empty line is skipped on load)
+        while queue or running:
+            while queue and len(running) < num_workers:
+                (reader, job) = start_track(*queue.popleft())
+                running[reader] = job
+            deadline = min(job[3] for job in running.values()) + TRACK_TIMEOUT
+            ready = wait(list(running), timeout=max(0, min(deadline - time.time(), PROGRESS_INTERVAL)))
+            now = time.time()
+            for (reader, job) in list(running.items()):
+                timed_out = reader not in ready and now - job[3] >= TRACK_TIMEOUT
+                if reader not in ready and not timed_out:
+                    continue
+                del running[reader]
+                record = finish_track(reader, job, timed_out)
+                if record is None:
+                    queue.append((job[1], job[2] + 1))
+                    continue
+                out.write(json.dumps(record) + '\n')
+                results[record['track']] = record
+                done += 1
+                if 'error' in record:
+                    failed += 1
+                if done % CHECKPOINT_INTERVAL == 0 or done == len(todo):
+                    out.flush()
+                    os.fsync(out.fileno())
+            if time.time() - last_progress >= PROGRESS_INTERVAL or done == len(todo):
+                last_progress = time.time()
+                rate = done / max(last_progress - start, 1e-6)
+                sys.stdout.write('\r%d/%d tracks (%.1f%%), %d failed, %.2f tracks/s, elapsed %s, ETA %s ' %
+                                 (done, len(todo), 100.0 * done / max(len(todo), 1), failed, rate,
+                                  format_duration(last_progress - start),
+                                  format_duration((len(todo) - done) / rate) if rate > 0 else '-'))
+                sys.stdout.flush()
+    print()
+    print("Extracted %d tracks (%d failed) in %.0f seconds" % (done, failed, time.time() - start))
+    return results
+
+results = extract_all_features(ts, RESULTS_PATH, NUM_WORKERS)
+# failed tracks get no features, so the generator's missing-key filter drops them
+track_features = {track: results[track].get('features', {}) if track in results else {} for track in ts}
+failures = Counter(record['error'] for record in results.values() if 'error' in record)
+for (error, count) in failures.most_common(10):
+    print("%6d failures: %s" % (count, error))
+
+# save results of all that processing in the columnar store read by GeneticMixTapeGenerator
+from MixTapeFeatureStore import FEATURE_STORE_PATH, writeFeatureStore
+writeFeatureStore(FEATURE_STORE_PATH, tracks_metadata, track_features)
 
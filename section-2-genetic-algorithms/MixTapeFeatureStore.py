@@ -0,0 +1,253 @@
+
+# Columnar track store for the mixtape generator, replacing tracks_metadata.pkl and
+# track_features.pkl. A store is a directory of .npy files that are memory-mapped on load, so
+# opening one costs the same for 1k or 100k tracks and nothing is read until it's used:
+#
+#   meta.json                       track count, metadata column names, genre/key/scale names
+#   tracks.offsets/.data            string table of track file names, sorted (row i = track i)
+#   duration, bpm, loudness, ...    one float64 column per numeric feature, NaN when missing;
+#                                   duration is in minutes, parsed from track_duration
+#   genre_offsets, genre_ids        the genres of row i are genre_ids[genre_offsets[i]:genre_offsets[i+1]]
+#   has_genres                      False when the features had no 'genres' entry
+#   tonal_key, tonal_scale          indexes into the key and scale names, -1 when missing
+#   metadata.<column>.offsets/.data string table per metadata column (JSON-encoded for columns
+#                                   whose values aren't strings, i.e. the track_genres lists)
+#
+# Converting the existing pickles:  python MixTapeFeatureStore.py [pickle dir] [store dir]
+
+import json
+import math
+import os
+import shutil
+import sys
+from collections.abc import Mapping
+
+import numpy
+
+FEATURE_STORE_PATH = 'track_store'
+STORE_VERSION = 1
+
+NUMERIC_FEATURES = ['bpm', 'loudness', 'loudness_range', 'beats_loudness', 'dissonance',
+                    'interest', 'listens', 'favorites']
+INTEGER_FEATURES = ['interest', 'listens', 'favorites']
+
+# track_duration is m:ss, h:mm:ss or plain seconds; NaN if it's none of these
+def parseDuration(duration):
+    try:
+        parts = [float(part) for part in duration.split(':')]
+    except ValueError:
+        return float('nan')
+    if len(parts) == 2:
+        return parts[0] + parts[1]/60.0
+    elif len(parts) == 3:
+        return parts[0] * 60.0 + parts[1] + parts[2]/60.0
+    return parts[0]/60.0
+
+def writeStringTable(path, name, strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(s) for s in encoded], out=offsets[1:])
+    numpy.save(os.path.join(path, name + '.offsets.npy'), offsets)
+    numpy.save(os.path.join(path, name + '.data.npy'), numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8))
+
+class StringTable:
+    def __init__(self, path, name):
+        self.offsets = numpy.load(os.path.join(path, name + '.offsets.npy'), mmap_mode='r')
+        self.data = numpy.load(os.path.join(path, name + '.data.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]]).decode('utf-8')
+
+    # all strings, decoding the table in one go
+    def tolist(self):
+        data = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [data[offsets[i] : offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+def writeFeatureStore(path, tracks_metadata, track_features):
+    tracks = sorted(tracks_metadata)
+    metadata_columns = []
+    for track in tracks:
+        for column in tracks_metadata[track]:
+            if column not in metadata_columns:
+                metadata_columns.append(column)
+    json_columns = [column for column in metadata_columns
+                    if any(not isinstance(tracks_metadata[track].get(column, ''), str) for track in tracks)]
+    features = [track_features.get(track, {}) for track in tracks]
+    genre_names = sorted(set(genre for f in features for genre in f.get('genres', [])))
+    genre_index = {genre: i for (i, genre) in enumerate(genre_names)}
+    key_names = sorted(set(f['tonal_key'] for f in features if 'tonal_key' in f))
+    key_index = {key: i for (i, key) in enumerate(key_names)}
+    # the prep script stored the scale as a 1-tuple (a stray trailing comma); keep just the name
+    scales = [f['tonal_scale'][0] if isinstance(f.get('tonal_scale'), tuple) else f.get('tonal_scale') for f in features]
+    scale_names = sorted(set(scale for scale in scales if scale is not None))
+    scale_index = {scale: i for (i, scale) in enumerate(scale_names)}
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    writeStringTable(tmp_path, 'tracks', tracks)
+    numpy.save(os.path.join(tmp_path, 'duration.npy'),
+               numpy.array([parseDuration(tracks_metadata[track].get('track_duration', '')) for track in tracks]))
+    for name in NUMERIC_FEATURES:
+        numpy.save(os.path.join(tmp_path, name + '.npy'),
+                   numpy.array([float(f[name]) if name in f else float('nan') for f in features]))
+    genre_counts = [len(f.get('genres', [])) for f in features]
+    genre_offsets = numpy.zeros(len(tracks) + 1, dtype=numpy.int64)
+    numpy.cumsum(genre_counts, out=genre_offsets[1:])
+    numpy.save(os.path.join(tmp_path, 'genre_offsets.npy'), genre_offsets)
+    numpy.save(os.path.join(tmp_path, 'genre_ids.npy'),
+               numpy.array([genre_index[genre] for f in features for genre in f.get('genres', [])], dtype=numpy.int32))
+    numpy.save(os.path.join(tmp_path, 'has_genres.npy'), numpy.array(['genres' in f for f in features]))
+    numpy.save(os.path.join(tmp_path, 'tonal_key.npy'),
+               numpy.array([key_index[f['tonal_key']] if 'tonal_key' in f else -1 for f in features], dtype=numpy.int16))
+    numpy.save(os.path.join(tmp_path, 'tonal_scale.npy'),
+               numpy.array([scale_index[scale] if scale is not None else -1 for scale in scales], dtype=numpy.int16))
+    for column in metadata_columns:
+        if column in json_columns:
+            values = [json.dumps(tracks_metadata[track].get(column, '')) for track in tracks]
+        else:
+            values = [tracks_metadata[track].get(column, '') for track in tracks]
+        writeStringTable(tmp_path, 'metadata.' + column, values)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'num_tracks': len(tracks),
+                   'metadata_columns': metadata_columns, 'json_columns': json_columns,
+                   'genres': genre_names, 'keys': key_names, 'scales': scale_names}, f)
+    # swap the finished store in, so an interrupted write never leaves a partial store behind
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+class FeatureStore:
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError("%s has store version %s, expected %d" % (path, meta['version'], STORE_VERSION))
+        self.path = path
+        self.num_tracks = meta['num_tracks']
+        self.metadata_columns = meta['metadata_columns']
+        self.json_columns = set(meta['json_columns'])
+        self.genre_names = meta['genres']
+        self.key_names = meta['keys']
+        self.scale_names = meta['scales']
+        self.tracks = StringTable(path, 'tracks')
+        load = lambda name: numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        self.duration = load('duration')
+        self.numeric = {name: load(name) for name in NUMERIC_FEATURES}
+        self.genre_offsets = load('genre_offsets')
+        self.genre_ids = load('genre_ids')
+        self.has_genres = load('has_genres')
+        self.tonal_key = load('tonal_key')
+        self.tonal_scale = load('tonal_scale')
+        self.metadata_tables = {}
+        self.track_rows = None
+        self.features = TrackFeatures(self)
+        self.metadata = TracksMetadata(self)
+
+    def __len__(self):
+        return self.num_tracks
+
+    def row(self, track):
+        if self.track_rows is None:
+            self.track_rows = {name: i for (i, name) in enumerate(self.tracks.tolist())}
+        return self.track_rows[track]
+
+    def metadataTable(self, column):
+        if column not in self.metadata_tables:
+            self.metadata_tables[column] = StringTable(self.path, 'metadata.' + column)
+        return self.metadata_tables[column]
+
+    # rows that have every feature the fitness function uses
+    def complete(self):
+        mask = self.has_genres & (self.tonal_key >= 0)
+        for name in ['bpm', 'loudness', 'beats_loudness', 'dissonance', 'interest', 'listens', 'favorites']:
+            mask &= ~numpy.isnan(self.numeric[name])
+        return mask
+
+    def hasGenre(self, genre):
+        mask = numpy.zeros(self.num_tracks, dtype=bool)
+        if genre in self.genre_names:
+            entries = numpy.flatnonzero(self.genre_ids == self.genre_names.index(genre))
+            mask[numpy.searchsorted(self.genre_offsets, entries, side='right') - 1] = True
+        return mask
+
+    # (position in rows, genre id) of every genre of the given rows
+    def genreEntries(self, rows):
+        starts = self.genre_offsets[rows]
+        counts = self.genre_offsets[rows + 1] - starts
+        positions = numpy.repeat(numpy.arange(len(rows)), counts)
+        entries = numpy.arange(counts.sum()) + numpy.repeat(starts - (numpy.cumsum(counts) - counts), counts)
+        return (positions, numpy.asarray(self.genre_ids[entries]))
+
+    def genres(self, row):
+        return [self.genre_names[g] for g in self.genre_ids[self.genre_offsets[row] : self.genre_offsets[row + 1]]]
+
+# read-only views with the shape of the old pickled dicts, built one track at a time on access
+
+class TrackFeatures(Mapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, track):
+        store = self.store
+        row = store.row(track)
+        f = {}
+        if store.has_genres[row]:
+            f['genres'] = store.genres(row)
+        for name in NUMERIC_FEATURES:
+            value = store.numeric[name][row]
+            if not math.isnan(value):
+                f[name] = int(value) if name in INTEGER_FEATURES else float(value)
+        if store.tonal_key[row] >= 0:
+            f['tonal_key'] = store.key_names[store.tonal_key[row]]
+        if store.tonal_scale[row] >= 0:
+            f['tonal_scale'] = store.scale_names[store.tonal_scale[row]]
+        return f
+
+    def __iter__(self):
+        return iter(self.store.tracks.tolist())
+
+    def __len__(self):
+        return len(self.store)
+
+class TracksMetadata(Mapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, track):
+        store = self.store
+        row = store.row(track)
+        m = {}
+        for column in store.metadata_columns:
+            value = store.metadataTable(column)[row]
+            m[column] = json.loads(value) if column in store.json_columns else value
+        return m
+
+    def __iter__(self):
+        return iter(self.store.tracks.tolist())
+
+    def __len__(self):
+        return len(self.store)
+
+def loadFeatureStore(path=FEATURE_STORE_PATH):
+    return FeatureStore(path)
+
+# migration from the pickles written by earlier versions of GeneticMixTapeGeneratorPrep
+def migratePickles(pickle_dir='.', path=FEATURE_STORE_PATH):
+    import pickle
+    import time
+    start = time.time()
+    with open(os.path.join(pickle_dir, 'tracks_metadata.pkl'), 'rb') as f:
+        tracks_metadata = pickle.load(f)
+    with open(os.path.join(pickle_dir, 'track_features.pkl'), 'rb') as f:
+        track_features = pickle.load(f)
+    writeFeatureStore(path, tracks_metadata, track_features)
+    print("Wrote %d tracks to %s in %.1f seconds" % (len(tracks_metadata), path, time.time() - start))
+
+if __name__ == '__main__':
+    migratePickles(*sys.argv[1:3])
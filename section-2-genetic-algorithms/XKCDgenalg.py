@@ -19,17 +19,9 @@
 xkcd comics: http://xkcd.com/287/. In the comic, the characters want to get
 exactly 15.05$ worth of appetizers, as fast as possible."""
 
+import array
+import os
 import random
-from operator import attrgetter
-from collections import Counter
-
-# We delete the reduction function of the Counter because it doesn't copy added
-# attributes. Because we create a class that inherits from the Counter, the
-# fitness attribute was not copied by the deepcopy. This is just a DEAP technicality
-# due to the fact we're using a standard Python class for our Individuals
-try:
-    del Counter.__reduce__
-except: pass
 
 import numpy
 
@@ -37,6 +29,7 @@ from deap import algorithms
 from deap import base
 from deap import creator
 from deap import tools
+import EvolutionLoop
 
 # Create the item dictionary: item id is an integer, and value is 
 # a (name, weight, value) 3-uple. Since the comic didn't specified a time for
@@ -49,6 +42,10 @@ ITEMS = {'French Fries': (2.75, 5),
          'Side Salad': (3.35, 3)}
 ITEMS_NAME = list(ITEMS.keys())
 
+# the menu as columns, with prices in whole cents so that totals are exact
+ITEM_CENTS = numpy.array([int(round(ITEMS[item][0] * 100)) for item in ITEMS_NAME])
+ITEM_TIMES = numpy.array([ITEMS[item][1] for item in ITEMS_NAME])
+
 # Our fitness function will have three values:
 # cost difference from target price (we want to spend as much as possible but not more than our budget),
 # time to eat (max of time to each individual appetizers),
@@ -57,64 +54,200 @@ ITEMS_NAME = list(ITEMS.keys())
 # -1.0 means we are minimzing that value, 1.0 means we are maximizing
 creator.create("FitnessMulti", base.Fitness, weights=(1.0, -1.0, 1.0))
 
-# Our "individual" will be a dictionary where the values are counts,
-# so, a Python Counter object; we'll look at example individuals below.
-creator.create("Individual", Counter, fitness=creator.FitnessMulti)
+# Our "individual" will be a fixed-width vector of counts, one per item of ITEMS_NAME,
+# so [2, 0, 0, 0, 1, 1] is two French Fries, a Sampler Plate and a Side Salad. An
+# array of C ints is compact, and DEAP knows how to copy it with its fitness.
+creator.create("Individual", array.array, typecode='i', fitness=creator.FitnessMulti)
 
 # initially, create individuals that have 2 items
 IND_INIT_SIZE = 2
 
+def initOrder(icls, size):
+    """Creates an order of size randomly-chosen items"""
+    individual = icls([0] * len(ITEMS_NAME))
+    for i in range(size):
+        individual[random.randrange(len(ITEMS_NAME))] += 1
+    return individual
+
 toolbox = base.Toolbox()
-# individuals will be made up of counts associated with food names (from ITEM_NAMES)
-toolbox.register("attr_item", random.choice, ITEMS_NAME)
-toolbox.register("individual", tools.initRepeat, creator.Individual, toolbox.attr_item, IND_INIT_SIZE)
+toolbox.register("individual", initOrder, creator.Individual, IND_INIT_SIZE)
 toolbox.register("population", tools.initRepeat, list, toolbox.individual)
 
+import sys
+
+TARGET_PRICE = 15.05
+
+# severely penalize individuals that are over budget ($15.05)
+# with a fixed terrible fitness
+overBudgetScore = (-sys.float_info.max, sys.float_info.max, -sys.float_info.max)
+
+def evalOrders(orders, target_price, prices=ITEM_CENTS, times=ITEM_TIMES):
+    """Evaluates a matrix of orders (one row of counts per order) at once:
+    one matrix product gives the price and the amount of food of every order,
+    and the time is that of the slowest item ordered (the chef cooks
+    everything in parallel). Orders over budget get overBudgetScore."""
+    # in floating point, which is exact for whole cents and lets the product use BLAS
+    (cents, food) = (orders @ numpy.column_stack((prices, numpy.ones_like(prices))).astype(float)).T
+    price_diff = (cents - int(round(target_price * 100))) / 100.0
+    scores = numpy.column_stack((price_diff, ((orders > 0) * times).max(axis=1, initial=0), food)).astype(float)
+    scores[price_diff > 0] = overBudgetScore
+    return scores
+
 def evalXKCD(individual, target_price):
     """Evaluates the fitness and return the error on the price and the time
     taken by the order if the chef can cook everything in parallel."""
-    price = 0.0
-    times = [0]
-    food = 0
-    for item, number in individual.items():
-        if number > 0:
-            price += ITEMS[item][0] * number
-            times.append(ITEMS[item][1])
-            food += number
-    return (price - target_price), max(times), food
-
-def cxCounter(ind1, ind2, indpb):
-    """Swaps the number of randomly-chosen items between two individuals"""
-    for key in ITEMS.keys():
-        if random.random() < indpb:
-            ind1[key], ind2[key] = ind2[key], ind1[key]
-    return ind1, ind2
-
-def mutCounter(individual):
+    return tuple(evalOrders(numpy.array([individual]), target_price)[0].tolist())
+
+def mutOrder(individual):
     """Adds or remove an item from an individual"""
     if random.random() > 0.5:
-        individual.update([random.choice(ITEMS_NAME)])
+        individual[random.randrange(len(individual))] += 1
     else:
-        val = random.choice(ITEMS_NAME)
-        individual.subtract([val])
-        if individual[val] < 0:
-            del individual[val]
+        i = random.randrange(len(individual))
+        individual[i] = max(individual[i] - 1, 0)
     return individual,
 
-import sys
-
-# register the functions, some with extra fixed arguments (like target_price)
-toolbox.register("evaluate", evalXKCD, target_price=15.05)
-# severely penalize individuals that are over budget ($15.05))
-# return a fixed terrible fitness
-toolbox.decorate("evaluate", tools.DeltaPenalty(lambda ind: evalXKCD(ind, 15.05)[0] <= 0,
-                                               (-sys.float_info.max,
-                                                sys.float_info.max,
-                                                -sys.float_info.max)))
-toolbox.register("mate", cxCounter, indpb=0.5)
-toolbox.register("mutate", mutCounter)
+# register the functions, some with extra fixed arguments (like target_price); evalOrders
+# applies the over-budget penalty itself, so an order is priced once (DeltaPenalty's
+# feasibility test would price it again)
+toolbox.register("evaluate", evalXKCD, target_price=TARGET_PRICE)
+toolbox.register("evaluate_batch", evalOrders, target_price=TARGET_PRICE)
+# swaps the number of randomly-chosen items between two individuals
+toolbox.register("mate", tools.cxUniform, indpb=0.5)
+toolbox.register("mutate", mutOrder)
 toolbox.register("select", tools.selNSGA2)
 
+# Evaluation for toolbox.map, which also times every batch. It stays in this process: an order
+# is evaluated in microseconds, less than it takes to send it to a worker process, so a pool
+# can't pay off on generations of LAMBDA=20 (the mixtape generator has the parallel backends).
+import time
+
+EVAL_REPORT_INTERVAL = 10 # generations between the evaluation reports printed after the run
+
+# Fitness cache: offspring often repeat an order that was already scored (a mutation removing an
+# item the order doesn't have, a crossover swapping equal counts), so Evaluator.map looks every
+# order up by its counts in an EvolutionLoop.FitnessCache first, which keeps the
+# FITNESS_CACHE_SIZE most recently used fitnesses (0 turns the cache off)
+FITNESS_CACHE_SIZE = 10000
+
+class Evaluator:
+    def __init__(self, cache_size=FITNESS_CACHE_SIZE):
+        self.cache = EvolutionLoop.FitnessCache(cache_size) if cache_size > 0 else None
+        self.times = [] # seconds spent on each batch; batch 0 is the initial population
+        self.counts = [] # individuals in each batch
+        self.evaluations = [] # individuals in each batch that were actually evaluated (not cached)
+
+    def map(self, func, individuals):
+        individuals = list(individuals)
+        if func is not toolbox.evaluate:
+            return list(map(func, individuals))
+        start = time.time()
+        if self.cache is None:
+            (fitnesses, evaluated) = (self.evaluate(individuals), len(individuals))
+        else:
+            (fitnesses, evaluated) = self.cache.evaluate(individuals, self.evaluate)
+        self.times.append(time.time() - start)
+        self.counts.append(len(individuals))
+        self.evaluations.append(evaluated)
+        return fitnesses
+
+    def evaluate(self, individuals):
+        if len(individuals) == 0:
+            return []
+        return [tuple(score) for score in toolbox.evaluate_batch(numpy.array(individuals)).tolist()]
+
+    # evaluations and cache hits every interval generations; printed after the run, as the
+    # logbook is printed during it
+    def report(self, interval):
+        for generation in range(interval, len(self.times), interval):
+            print("Generation %d: %d evaluations (%d cached) in %.2f ms" %
+                  (generation, self.counts[generation], self.counts[generation] - self.evaluations[generation],
+                   self.times[generation] * 1000))
+        print("Evaluated %d individuals in %.3f seconds, %d of them evaluated and %d from the fitness cache" %
+              (sum(self.counts), sum(self.times), sum(self.evaluations), sum(self.counts) - sum(self.evaluations)))
+
+evaluator = Evaluator()
+toolbox.register("map", evaluator.map)
+
+# Exact baseline to check the GA against: the true Pareto front, by dynamic programming over the
+# price in cents. most_food[t, c] is the most food in an order costing exactly c cents whose
+# items all cook within the time limit levels[t] (an unbounded knapsack for every time limit at
+# once, with the items sorted by price so the affordable ones are a prefix). An order is on the
+# front if no order within a lower time limit costs as much or more with as much food, and no
+# order within the same or a lower limit costs more with as much food.
+def solveXKCD(target_price, prices=ITEM_CENTS, times=ITEM_TIMES):
+    """Returns the orders (one row of counts per order) on the exact Pareto front."""
+    target = int(round(target_price * 100))
+    levels = numpy.unique(numpy.concatenate(([0], times)))
+    by_price = numpy.argsort(prices, kind='stable')
+    sorted_prices = prices[by_price]
+    allowed = times[by_price][None, :] <= levels[:, None]
+    rows = numpy.arange(len(levels))
+    most_food = numpy.full((len(levels), target + 1), -1, dtype=numpy.int64) # -1: no such order
+    most_food[:, 0] = 0
+    last_item = numpy.zeros((len(levels), target + 1), dtype=numpy.int64)
+    for c in range(1, target + 1):
+        k = numpy.searchsorted(sorted_prices, c, side='right')
+        if k == 0:
+            continue
+        previous = most_food[:, c - sorted_prices[:k]]
+        food = numpy.where(allowed[:, :k] & (previous >= 0), previous + 1, -1)
+        best = food.argmax(axis=1)
+        most_food[:, c] = food[rows, best]
+        last_item[:, c] = by_price[best]
+    # the most food within time limit t for a price of c or more
+    covered = numpy.maximum.accumulate(numpy.maximum.accumulate(most_food[:, ::-1], axis=1)[:, ::-1], axis=0)
+    lower_limit = numpy.vstack((numpy.full((1, target + 1), -1), covered[:-1]))
+    pricier = numpy.hstack((covered[:, 1:], numpy.full((len(levels), 1), -1)))
+    on_front = (most_food >= 0) & (most_food > lower_limit) & (most_food > pricier)
+    orders = []
+    for (t, c) in zip(*numpy.nonzero(on_front)):
+        order = numpy.zeros(len(prices), dtype=numpy.int64)
+        while c > 0:
+            order[last_item[t, c]] += 1
+            c -= prices[last_item[t, c]]
+        orders.append(order)
+    return numpy.array(orders).reshape(-1, len(prices))
+
+# evaluations per second of evalOrders against one order at a time (as evalXKCD used to loop over
+# a Counter), and the time solveXKCD takes, on the menu and on a random menu of 1000 items
+BENCHMARK_XKCD = False
+
+if BENCHMARK_XKCD:
+    def evalLoop(order, target_price, prices, times):
+        price = 0
+        slowest = 0
+        food = 0
+        for (i, number) in enumerate(order):
+            if number > 0:
+                price += prices[i] * number
+                slowest = max(slowest, times[i])
+                food += number
+        return (price / 100.0 - target_price), slowest, food
+    rng = numpy.random.RandomState(0)
+    for (size, target_price) in [(len(ITEMS_NAME), TARGET_PRICE), (1000, 100.0)]:
+        if size == len(ITEMS_NAME):
+            (prices, times) = (ITEM_CENTS, ITEM_TIMES)
+        else:
+            (prices, times) = (rng.randint(100, 2001, size=size), rng.randint(1, 21, size=size))
+        orders = numpy.zeros((10000, size), dtype=numpy.int64)
+        numpy.add.at(orders, (numpy.repeat(numpy.arange(10000), 5), rng.randint(0, size, size=50000)), 1)
+        start = time.time()
+        scores = evalOrders(orders, target_price, prices, times)
+        batched = time.time() - start
+        rows = orders.tolist()
+        (price_list, time_list) = (prices.tolist(), times.tolist())
+        start = time.time()
+        for order in rows:
+            evalLoop(order, target_price, price_list, time_list)
+        looped = time.time() - start
+        start = time.time()
+        front = solveXKCD(target_price, prices, times)
+        solved = time.time() - start
+        print("%d items: evalOrders %.0f orders/s, one at a time %.0f orders/s (%.0fx); "
+              "exact front of %d orders for $%.2f in %.2f s" %
+              (size, len(rows) / batched, len(rows) / looped, looped / batched, len(front), target_price, solved))
+
 
 # Simulation parameters:
 # Number of generations = 100
@@ -150,11 +283,98 @@ food_stats = tools.Statistics(key=lambda ind: ind.fitness.values[2])
 stats = tools.MultiStatistics(price=price_stats, time=time_stats, food=food_stats)
 stats.register("avg", numpy.mean, axis=0)
 
+# Per-generation telemetry (see EvolutionLoop.py): a JSON lines or CSV file (by its extension)
+# with the time of each phase of every generation, the evaluation, cache and penalty counts and
+# the objective averages, or None for no log; one generation in every PROFILE_INTERVAL runs
+# under cProfile (0 for none)
+GENERATION_LOG = None # e.g. 'xkcd-generations.jsonl'
+PROFILE_INTERVAL = 0
+
+def generationLog(path, append=False):
+    return EvolutionLoop.GenerationLog(path,
+                                       scored=(lambda: evaluator.evaluations[-1]) if evaluator.cache is not None else None,
+                                       penalty=overBudgetScore, profile_interval=PROFILE_INTERVAL, append=append)
+
+# the run time of DEAP's eaMuPlusLambda, and of EvolutionLoop's with and without a log, over the
+# same seeded runs; XKCD generations are the cheapest there are, so this is the worst case of the
+# log's overhead
+BENCHMARK_TELEMETRY = False
+
+if BENCHMARK_TELEMETRY:
+    import tempfile
+    BENCHMARK_NGEN = 2000
+    def timeRun(run, log_path=None):
+        # each run with a cold fitness cache of its own
+        global evaluator
+        evaluator = Evaluator()
+        toolbox.register("map", evaluator.map)
+        random.seed(0)
+        log = generationLog(log_path) if log_path is not None else None
+        population = toolbox.population(n=MU)
+        start = time.perf_counter()
+        if log is None:
+            run(population, toolbox, MU, LAMBDA, CXPB, MUTPB, BENCHMARK_NGEN, stats,
+                halloffame=tools.ParetoFront(), verbose=False)
+        else:
+            run(population, toolbox, MU, LAMBDA, CXPB, MUTPB, BENCHMARK_NGEN, stats,
+                halloffame=tools.ParetoFront(), verbose=False, log=log)
+            log.close()
+        return (time.perf_counter() - start, [ind.fitness.values for ind in population])
+    log_dir = tempfile.mkdtemp()
+    (deap_time, deap_fitnesses) = timeRun(algorithms.eaMuPlusLambda)
+    (loop_time, loop_fitnesses) = timeRun(EvolutionLoop.eaMuPlusLambda)
+    for extension in ['jsonl', 'csv']:
+        (logged_time, logged_fitnesses) = timeRun(EvolutionLoop.eaMuPlusLambda,
+                                                  os.path.join(log_dir, 'generations.' + extension))
+        print("%d generations: DEAP %.2f s, EvolutionLoop %.2f s, with a %s log %.2f s (%+.1f%%), same populations: %s" %
+              (BENCHMARK_NGEN, deap_time, loop_time, extension, logged_time,
+               100.0 * (logged_time - deap_time) / deap_time,
+               deap_fitnesses == loop_fitnesses == logged_fitnesses))
+    evaluator = Evaluator()
+    toolbox.register("map", evaluator.map)
+
+# Checkpoints (see EvolutionLoop.py): every CHECKPOINT_INTERVAL generations the run is saved to
+# CHECKPOINT_PATH (None for no checkpoints), and with RESUME a run continues from the checkpoint
+# there, if there is one, to NGEN generations
+CHECKPOINT_PATH = None # e.g. 'xkcd-checkpoint.pkl.gz'
+CHECKPOINT_INTERVAL = 10
+RESUME = False
+
 # run the simulation
-algorithms.eaMuPlusLambda(pop, toolbox, MU, LAMBDA, CXPB, MUTPB, NGEN,
-                          stats, halloffame=hof)
+resume = None
+if RESUME and CHECKPOINT_PATH is not None and os.path.exists(CHECKPOINT_PATH):
+    resume = EvolutionLoop.loadCheckpoint(CHECKPOINT_PATH)
+    (pop, hof) = (resume['population'], resume['halloffame'])
+    print("Resuming from generation %d of %s" % (resume['gen'], CHECKPOINT_PATH))
+checkpoint = EvolutionLoop.Checkpointer(CHECKPOINT_PATH, CHECKPOINT_INTERVAL) if CHECKPOINT_PATH is not None else None
+log = generationLog(GENERATION_LOG, append=resume is not None) if GENERATION_LOG is not None else None
+start = time.time()
+EvolutionLoop.eaMuPlusLambda(pop, toolbox, MU, LAMBDA, CXPB, MUTPB, NGEN,
+                             stats, halloffame=hof, log=log, checkpoint=checkpoint, resume=resume)
+ga_time = time.time() - start
+if checkpoint is not None:
+    checkpoint.close()
+evaluator.report(EVAL_REPORT_INTERVAL)
+if log is not None:
+    log.close()
+    print("Generation phases: %s" % log.summary())
+
+def orderItems(individual):
+    return {item: int(number) for (item, number) in zip(ITEMS_NAME, individual) if number > 0}
+
+print("Best:", orderItems(hof[0]), hof[0].fitness.values)
 
-print("Best:", hof[0], hof[0].fitness.values)
+# how close the GA got to the exact Pareto front
+start = time.time()
+exact = solveXKCD(TARGET_PRICE)
+exact_time = time.time() - start
+exact_scores = set(tuple(score) for score in evalOrders(exact, TARGET_PRICE).tolist())
+print("GA: %d orders in its Pareto front in %.2f seconds, %d of them on the exact front" %
+      (len(hof), ga_time, sum(1 for ind in hof if ind.fitness.values in exact_scores)))
+print("Exact: %d orders in the Pareto front in %.3f seconds" % (len(exact), exact_time))
+for order in exact:
+    if order @ ITEM_CENTS == int(round(TARGET_PRICE * 100)):
+        print("Exactly $%.2f:" % TARGET_PRICE, orderItems(order))
 
 
 
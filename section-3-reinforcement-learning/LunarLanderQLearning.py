@@ -73,14 +73,99 @@ def run(num_episodes, alpha, gamma, explore_mult):
         
     return (max_rewards, last_reward[-50:], qtable) # return rewards from last 50 episodes
 
+# Vectorized training: num_envs environments step together, each starting a new episode as soon
+# as its last one ends. Their states are discretized at once with the arithmetic of
+# discretize_state (floor and clip give the same bins as int and the if-statements), actions are
+# picked and the Q-table updated with array operations over the flattened table. The targets of a
+# step are computed from the table before the step's updates; when several environments update
+# the same (state, action), the updates compose as if applied one after another:
+# q <- (1-alpha)^k q + sum_j alpha (1-alpha)^(k-1-j) target_j for the k updates j = 0..k-1.
+# The explore rate decays once per finished episode, as in run.
+STATE_OFFSETS = np.array([0.7, 0.5, 1.5, 2, 3.14159])
+STATE_DIVISORS = np.array([2.0, 2.0, 3.0, 3.0, 2*3.14159])
+
+def discretize_states(states):
+    bins = np.floor(0.5*(states[:, :5]+STATE_OFFSETS)*10/STATE_DIVISORS)
+    return np.ravel_multi_index(np.clip(bins, 0, 4).astype(int).T, (5, 5, 5, 5, 5))
+
+def batch_q_update(qflat, index, targets, alpha):
+    order = np.argsort(index, kind='stable')
+    sorted_index = index[order]
+    (unique, first, counts) = np.unique(sorted_index, return_index=True, return_counts=True)
+    later = np.repeat(first + counts, counts) - 1 - np.arange(len(index)) # updates after each one
+    qflat[unique] *= (1.0-alpha) ** counts
+    np.add.at(qflat, sorted_index, alpha * (1.0-alpha) ** later * targets[order])
+
+def run_vectorized(num_episodes, alpha, gamma, explore_mult, num_envs):
+    envs = [gym.make('LunarLander-v2') for i in range(num_envs)]
+    max_rewards = []
+    last_reward = []
+    qtable = np.subtract(np.zeros((5, 5, 5, 5, 5, ACTIONS)), 100) # start all rewards at -100
+    qstates = qtable.reshape(-1, ACTIONS) # views of qtable
+    qflat = qtable.reshape(-1)
+    explore_rate = 1.0
+    states = discretize_states(np.array([env.reset() for env in envs]))
+    steps = np.zeros(num_envs, dtype=int)
+    env_steps = 0
+    while len(last_reward) < num_episodes:
+        # select actions
+        actions = np.argmax(qstates[states], axis=1)
+        explore = np.random.random(num_envs) < explore_rate
+        actions[explore] = np.random.randint(ACTIONS, size=explore.sum())
+
+        results = [env.step(action) for (env, action) in zip(envs, actions)]
+        new_states = discretize_states(np.array([new_s for (new_s, _, _, _) in results]))
+        rewards = np.array([reward for (_, reward, _, _) in results])
+        dones = np.array([done for (_, _, done, _) in results]) | (steps == 9999)
+
+        # update Q
+        best_future_q = np.amax(qstates[new_states], axis=1) # best possible reward from the next states
+        batch_q_update(qflat, states*ACTIONS + actions, rewards + gamma*best_future_q, alpha)
+        states = new_states
+        steps += 1
+        env_steps += num_envs
+
+        for i in np.flatnonzero(dones):
+            last_reward.append(rewards[i])
+            if explore_rate > 0.01:
+                explore_rate *= explore_mult
+            max_rewards.append(np.amax(qtable))
+            states[i] = discretize_states(np.array([envs[i].reset()]))[0]
+            steps[i] = 0
+
+    for env in envs:
+        env.close()
+    # rewards from the last 50 episodes, and the number of environment steps taken
+    return (max_rewards[:num_episodes], last_reward[:num_episodes][-50:], qtable, env_steps)
+
+# environments trained at once; 1 trains with run, more with run_vectorized
+NUM_ENVS = 1
+
+def train(num_episodes, alpha, gamma, explore_mult):
+    if NUM_ENVS > 1:
+        return run_vectorized(num_episodes, alpha, gamma, explore_mult, NUM_ENVS)[:3]
+    return run(num_episodes, alpha, gamma, explore_mult)
+
+# environment steps per second of run_vectorized for growing numbers of environments (on one core
+# with gym 0.25.2: about 4400 for 1, 8500 for 16 and 8300 for 64; the Box2D physics of env.step,
+# which still runs one environment at a time, is most of what's left)
+BENCHMARK_VECTORIZED = False
+
+if BENCHMARK_VECTORIZED:
+    import time
+    for num_envs in [1, 16, 64]:
+        start = time.time()
+        (_, _, _, env_steps) = run_vectorized(num_episodes=2*num_envs, alpha=0.1, gamma=0.95,
+                                              explore_mult=0.995, num_envs=num_envs)
+        print("%d environments: %.0f steps per second" % (num_envs, env_steps / (time.time() - start)))
 
 num_episodes = 100
 for alpha in [0.05, 0.10, 0.15]:
     for gamma in [0.85, 0.90, 0.95]:
-        (max_rewards, last_reward, _) = run(num_episodes=num_episodes, alpha=alpha, gamma=gamma, explore_mult=0.995)
+        (max_rewards, last_reward, _) = train(num_episodes=num_episodes, alpha=alpha, gamma=gamma, explore_mult=0.995)
         print("alpha = %.2f, gamma = %.2f, mean last 50 outcomes = %.2f, q max: %.2f, q mean: %.2f" % (alpha, gamma, np.mean(last_reward), np.max(max_rewards), np.mean(max_rewards)))
 
-(max_rewards, last_reward, qtable) = run(num_episodes=200, alpha=0.1, gamma=0.95, explore_mult=0.995)
+(max_rewards, last_reward, qtable) = train(num_episodes=200, alpha=0.1, gamma=0.95, explore_mult=0.995)
 print("mean last 50 outcomes = %.2f, q max: %.2f, q mean: %.2f" % (np.mean(last_reward), np.max(max_rewards), np.mean(max_rewards)))
 np.save('qtable.npy', qtable)
 